@@ -0,0 +1,238 @@
+"""Times the geometry and rendering hot paths offline and compares them with a
+stored baseline, failing if any has regressed.
+
+    python -m benchmarks.hot_paths --save        # record a baseline
+    python -m benchmarks.hot_paths               # compare against it
+    python -m benchmarks.hot_paths --require-baseline   # gate, e.g. in CI
+    python -m benchmarks.hot_paths -k buffer --sizes 4,64 --threshold 0.5
+
+Geometry is measured on synthetic rings of 4 to 10,000 vertices and on rings
+recorded from the parcel server. The per-vertex Python geometry (`buffer_ring`
+is quadratic) is only run up to the size in its case, and the vectorized
+`ParcelCollection` equivalents are run alongside for comparison. Each case
+records the time per call and the peak memory allocated by one call, traced
+with `tracemalloc`.
+
+Timings are the median of `--repeat` runs, each long enough (at least 0.2 s)
+to swamp timer resolution. Cases taking only microseconds still vary by tens
+of percent between processes, so differences smaller than `--noise-floor`
+(in microseconds per call, or one KiB of peak memory) are never counted as
+regressions.
+
+The baseline is machine specific, so it is not committed; record it while
+the machine is otherwise idle. A case regresses if its time or peak memory
+exceeds the baseline by more than `--threshold` or `--memory-threshold`
+(fractions of the baseline); the run then exits with status 1. By default a missing baseline, or cases without a baseline entry,
+are skipped. With `--require-baseline` they fail the run too, as does any
+baselined case (matching `-k`) which was not run.
+"""
+
+import argparse
+import json
+import math
+import os
+import statistics
+import sys
+import tempfile
+import timeit
+import tracemalloc
+import warnings
+from dataclasses import asdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from planreview import comment, esri, pdf
+
+from .pdf_size import sample_applicant, sample_master
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+SIZES = [4, 64, 256, 1024, 10000]
+
+# Smallest differences counted as regressions.
+NOISE_FLOOR = 25e-6
+MEMORY_FLOOR = 1024
+
+# Rings as returned by the PAGIS parcel server, in State Plane feet.
+RECORDED = {
+    "pulaski county": [
+        [1229623,151187],[1229590,150990],[1229452,151014],[1229485,151211],[1229623,151187],
+    ],
+    "city hall": [
+        [1228929.53,151406.27],[1228904.93,151258.39],[1228766.98,151281.79],
+        [1228791.58,151429.67],[1228929.53,151406.27],
+    ],
+}
+
+def synthetic_ring(n: int) -> List[List[float]]:
+    """A closed, star shaped ring of `n` distinct vertices with a repeatable
+    wobble in its radius, roughly the size of a large parcel.
+    """
+    ring = []
+    for i in range(n):
+        theta = 2*math.pi*i/n
+        r = 200.0 + 30.0*math.sin(7*theta) + 10.0*math.sin(23*theta)
+        ring.append([1229000.0 + r*math.cos(theta), 151000.0 + r*math.sin(theta)])
+    ring.append(list(ring[0]))
+    return ring
+
+def rings(sizes: List[int]) -> Dict[str, List[List[float]]]:
+    result = {str(n): synthetic_ring(n) for n in sizes}
+    result.update(RECORDED)
+    return result
+
+# Each geometry case is a name, the largest synthetic ring it is run on and a
+# function which takes a ring and returns the call to time.
+def geometry_cases() -> List[Tuple[str, Optional[int], Callable[[List[List[float]]], Callable[[], Any]]]]:
+    def buffer(ring):
+        return lambda: esri.buffer_ring([list(p) for p in ring], 100)
+    def outside(ring):
+        point = [ring[0][0] + 1.0, ring[0][1] + 1.0]
+        return lambda: esri.is_outside(ring, point)
+    def intersections(ring):
+        origin, point = [-1.0, -1.0], esri.centroid(ring)
+        target = [point['x'], point['y']]
+        edges = list(zip(ring[:-1], ring[1:]))
+        return lambda: [esri.intersection(origin, target, a, b) for a, b in edges]
+    def envelope(ring):
+        return lambda: (esri.make_envelope(ring), esri.centroid(ring))
+    def in_ring(ring):
+        env = esri.make_envelope(ring)
+        points = [[env.xmin + (env.xmax - env.xmin)*i/31, env.ymin + (env.ymax - env.ymin)*j/31] for i in range(32) for j in range(32)]
+        return lambda: esri.points_in_ring(ring, points)
+    def collection(ring):
+        return lambda: esri.ParcelCollection([ring]*16).envelopes()
+    def collection_buffer(ring):
+        return lambda: esri.ParcelCollection([ring]).buffers(100)
+    return [
+        ("buffer_ring", 256, buffer),
+        ("is_outside", None, outside),
+        ("intersection", None, intersections),
+        ("make_envelope+centroid", None, envelope),
+        ("points_in_ring[1024]", None, in_ring),
+        ("ParcelCollection.envelopes[16]", None, collection),
+        ("ParcelCollection.buffers", None, collection_buffer),
+    ]
+
+def rendering_cases(tmp: str) -> List[Tuple[str, Callable[[], Any]]]:
+    master = sample_master()
+    applicant = sample_applicant()
+    comments = comment.generate_base_comments(master)
+    dest = os.path.join(tmp, "letter.pdf")
+    def letter(optimize: bool):
+        def write():
+            pdf.save(pdf.generate(comments, asdict(applicant), "Sausage Theme Park", False, optimize), dest)
+        return write
+    return [
+        ("generate_base_comments", lambda: comment.generate_base_comments(master)),
+        ("generate_email", lambda: comment.generate_email(comments, applicant, False)),
+        ("pdf.generate+save", letter(False)),
+        ("pdf.generate+save[optimize]", letter(True)),
+    ]
+
+def measure(fn: Callable[[], Any], repeat: int=7) -> Dict[str, float]:
+    """Returns the median time per call in seconds and the peak bytes traced
+    during one call.
+    """
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    seconds = statistics.median(timer.repeat(repeat, number)) / number
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": seconds, "peak_bytes": peak}
+
+def run(sizes: List[int], pattern: Optional[str]=None, repeat: int=7) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for name, limit, setup in geometry_cases():
+        for label, ring in rings(sizes).items():
+            if label.isdigit() and limit is not None and int(label) > limit:
+                continue
+            key = f"{name} {label}"
+            if pattern and pattern not in key:
+                continue
+            results[key] = measure(setup(ring), repeat)
+            report(key, results[key])
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, fn in rendering_cases(tmp):
+            if pattern and pattern not in name:
+                continue
+            results[name] = measure(fn, repeat)
+            report(name, results[name])
+    return results
+
+def human_time(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds/scale:.3g} {unit}"
+    return f"{seconds/1e-9:.3g} ns"
+
+def report(key: str, result: Dict[str, float]) -> ():
+    print(f"{key:<44} {human_time(result['seconds']):>10} {result['peak_bytes']/1024:>10.1f} KiB")
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], threshold: float, memory_threshold: float, strict: bool=False, noise_floor: float=NOISE_FLOOR, memory_floor: int=MEMORY_FLOOR) -> List[str]:
+    """Returns the cases slower or larger than the baseline allows. A case
+    only regresses by more than `noise_floor` seconds or `memory_floor` bytes.
+    With `strict`, cases missing from either the results or the baseline are
+    returned too.
+    """
+    regressed = []
+    if strict:
+        regressed.extend(f"{key}: not run" for key in baseline if key not in results)
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            if strict:
+                regressed.append(f"{key}: no baseline")
+            continue
+        slower = result["seconds"] / base["seconds"] - 1
+        larger = result["peak_bytes"] / base["peak_bytes"] - 1 if base["peak_bytes"] else 0.0
+        slower_by = result["seconds"] - base["seconds"]
+        larger_by = result["peak_bytes"] - base["peak_bytes"]
+        if (slower > threshold and slower_by > noise_floor) or (larger > memory_threshold and larger_by > memory_floor):
+            regressed.append(f"{key}: time {slower:+.0%}, peak memory {larger:+.0%}")
+    return regressed
+
+def main(argv: Optional[List[str]]=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.hot_paths")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON file")
+    parser.add_argument("--save", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown as a fraction of the baseline")
+    parser.add_argument("--memory-threshold", type=float, default=0.25, help="allowed peak memory growth as a fraction of the baseline")
+    parser.add_argument("--noise-floor", type=float, default=NOISE_FLOOR*1e6, help="slowdown in microseconds per call always allowed")
+    parser.add_argument("--require-baseline", action="store_true", help="fail if the baseline or any case in it is missing")
+    parser.add_argument("--sizes", default=','.join(map(str, SIZES)), help="synthetic ring sizes in vertices")
+    parser.add_argument("--repeat", type=int, default=7, help="timing repeats per case, of which the median is taken")
+    parser.add_argument("-k", dest="pattern", help="only run cases containing this text")
+    args = parser.parse_args(argv)
+    # the per-vertex geometry divides by zero on vertical edges by design
+    warnings.simplefilter("ignore", RuntimeWarning)
+    sizes = [int(n) for n in args.sizes.split(',') if n]
+    if not args.save and not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}; run with --save to record one")
+        return 1 if args.require_baseline else 0
+    results = run(sizes, args.pattern, args.repeat)
+    if args.save:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"saved {len(results)} cases to {args.baseline}")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if args.pattern:
+        baseline = {key: base for key, base in baseline.items() if args.pattern in key}
+    regressed = compare(results, baseline, args.threshold, args.memory_threshold, args.require_baseline, args.noise_floor*1e-6)
+    for line in regressed:
+        print(f"FAILED {line}")
+    print(f"{len(results) - len(regressed)} of {len(results)} cases within threshold")
+    return 1 if regressed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,53 @@
+"""Reports the size in bytes of a typical comment letter with and without the
+optimised PDF output mode.
+
+    python -m benchmarks.pdf_size
+"""
+
+import os
+import tempfile
+
+from planreview import comment, esri
+
+def sample_master() -> comment.Master:
+    parcel = esri.ParcelData(
+        {'x':1228857,'y':151362},
+        [[0.0,0.0],[0.0,200.0],[200.0,200.0],[200.0,0.0],[0.0,0.0]],
+        2.5,
+        esri.Envelope(0.0,0.0,200.0,200.0),
+    )
+    streets = [
+        esri.Street("W MARKHAM ST","commercial",60,True,False),
+        esri.Street("BROADWAY ST","principal arterial",110,True,True),
+    ]
+    return comment.Master(comment.Meta(), parcel, streets, {"AE"}, esri.Zone("C3",None,None))
+
+def sample_comments():
+    return comment.generate_base_comments(sample_master())
+
+def sample_applicant() -> comment.Applicant:
+    return comment.Applicant(
+        "Abe Frohman, P.E.",
+        "Sausage King of Chicago",
+        "Mr. Frohman",
+        "Sausage Works Inc.",
+        "123 Meat Lane",
+        "Chicago, IL 12345",
+    )
+
+def letter_size(comments, optimize: bool) -> int:
+    applicant = sample_applicant()
+    with tempfile.TemporaryDirectory() as tmp:
+        dest = os.path.join(tmp, "letter.pdf")
+        comment.generate_letter(comments,applicant,"Sausage Theme Park",dest,False,optimize)
+        return os.path.getsize(dest)
+
+def main():
+    comments = sample_comments()
+    default = letter_size(comments, False)
+    optimized = letter_size(comments, True)
+    print(f"default:   {default:>8} bytes/letter")
+    print(f"optimized: {optimized:>8} bytes/letter ({optimized/default:.1%})")
+
+if __name__ == "__main__":
+    main()
@@ -1,56 +1,78 @@
 import asyncio
 import logging
 import sys
-import os
 
-from planreview import esri
 from planreview import comment
+from planreview import batch
+from planreview import service
+from planreview import prefetch
+from planreview import history
+from planreview import subdivision
 
 async def main() -> ():
     location = sys.argv[1]
-    if ' ' in location: # it's an address
-        loc = esri.geocode(location)
-        if loc is None:
-            logging.critical(f"Cannot geocode {location}! Exiting...")
-            return
-        params = esri.params_from_loc(loc)
-    else:
-        params = esri.params_from_pid(location)
-    parcel = esri.fetch_parcel(params)
-    ring = parcel.ring
-    buffer_ring = esri.buffer_ring(ring, 100)
-    floodhaz = await asyncio.coroutine(esri.floodmap)(ring)
-    zoning = await asyncio.coroutine(esri.zoning)(ring)
-    streets = await asyncio.coroutine(esri.trans)(buffer_ring)
-    project = input("Project name: ")
+    cache = prefetch.SurveyCache()
+    # GIS queries run in the background while the prompts below are answered
+    gis = asyncio.create_task(prefetch.survey(location, cache))
+    gis.add_done_callback(warn_missing)
+    project = await ask("Project name: ")
     applicant = comment.Applicant(
-        input("applicant name: "),
-        input("applicant title: "),
-        input("applicant salutation: "),
-        input("applicant company: "),
-        input("applicant address first line: "),
-        input("applicant city, state zip: "),
+        await ask("applicant name: "),
+        await ask("applicant title: "),
+        await ask("applicant salutation: "),
+        await ask("applicant company: "),
+        await ask("applicant address first line: "),
+        await ask("applicant city, state zip: "),
     )
-    subdivision = parse_yn('subdivision')
-    grading = parse_yn('grading permit required')
-    franchise = parse_yn('franchise required')
-    wall = parse_yn('retaining wall')
-    detention = parse_yn('detention required')
-    approved = parse_yn('approved')
+    subdivision = await parse_yn('subdivision')
+    grading = await parse_yn('grading permit required')
+    franchise = await parse_yn('franchise required')
+    wall = await parse_yn('retaining wall')
+    detention = await parse_yn('detention required')
+    approved = await parse_yn('approved')
     meta = comment.Meta(subdivision, grading, franchise, wall, detention)
-    master = comment.Master(meta,parcel,streets,floodhaz,zoning)
+    try:
+        survey = await gis
+    except batch.LayerError as e:
+        logging.critical(f"GIS query failed: {e}! Exiting...")
+        return
+    finally:
+        cache.close()
+    if survey is None:
+        logging.critical(f"Cannot find a parcel for {location}! Exiting...")
+        return
+    master = survey.master(meta)
     base_comments = comment.generate_base_comments(master)
-    more_comments = parse_yn("Make special comments")
+    more_comments = await parse_yn("Make special comments")
     while more_comments:
-        base_comments.append(input(">> "))
-        more_comments = parse_yn("additional comments")
+        base_comments.append(await ask(">> "))
+        more_comments = await parse_yn("additional comments")
     comment.generate_letter(base_comments,applicant,project,"Public Works comments.pdf",approved)
 
-def parse_yn(prompt: str):
-    response = input(f"{prompt} (y/n): ")
+def warn_missing(gis: asyncio.Task):
+    if not gis.cancelled() and gis.exception() is None and gis.result() is None:
+        logging.critical(f"Cannot find a parcel for {sys.argv[1]}!")
+
+async def ask(prompt: str) -> str:
+    """`input` which leaves the event loop free to run GIS queries."""
+    return await asyncio.to_thread(input, prompt)
+
+async def parse_yn(prompt: str):
+    response = await ask(f"{prompt} (y/n): ")
     if response.strip().lower() == 'y':
         return True
     return False
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if sys.argv[1:2] == ["batch"]:
+        asyncio.run(batch.main(sys.argv[2:]))
+    elif sys.argv[1:2] == ["serve"]:
+        asyncio.run(service.main(sys.argv[2:]))
+    elif sys.argv[1:2] == ["prefetch"]:
+        asyncio.run(prefetch.main(sys.argv[2:]))
+    elif sys.argv[1:2] == ["rereview"]:
+        asyncio.run(history.main(sys.argv[2:]))
+    elif sys.argv[1:2] == ["subdivision"]:
+        asyncio.run(subdivision.main(sys.argv[2:]))
+    else:
+        asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,294 @@
+"""## batch
+
+batch reviews many submittals in one run. Records are read from a JSON lines
+file, one submittal per line:
+
+```
+{"location": "701 W MARKHAM", "project": "City Hall", "dest": "city hall.pdf",
+ "applicant": {"name": ..., "title": ..., "salutation": ..., "company": ...,
+               "address": ..., "city_state_zip": ...},
+ "meta": {"grading": true, "detention": false}, "approved": false,
+ "comments": ["special comment", ...]}
+```
+
+Each record follows the same workflow as an interactive review:
+
+```
+locate parcel -> buffer -> query layers -> render comments -> write letter
+```
+
+GIS queries are network bound and run on the event loop's default thread pool
+so many records may wait on the servers at once. Buffering is a vectorized
+`esri.ParcelCollection` pass and runs inline. Letter rendering is CPU bound and
+is handed to a process pool, so it scales with cores instead of serializing
+on the GIL. Everything sent to the pool is a plain dataclass from `esri` or
+`comment`, which pickle cheaply.
+
+Records flow through a `pipeline` of three stages, `gis`, `render` and `write`,
+sized by `--concurrency`, `--workers` and `--writers`. The queues between stages
+are bounded, so a slow stage holds back the one before it instead of letting
+work pile up. `--progress SECONDS` prints each stage's queue depth and
+throughput while the batch runs.
+
+With `--frontage`, the buffer step is skipped: street centerlines are fetched
+once per area into an `esri.StreetNetwork` shared by every record, and the
+streets fronting each parcel are measured against them.
+"""
+
+import asyncio
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from . import codec
+from . import esri
+from . import comment
+from . import pdf
+from . import pipeline
+
+log = logging.getLogger(__name__)
+
+BUFFER = 100
+
+class LayerError(LookupError):
+    """A GIS layer query failed for a parcel that was found, so the review may
+    succeed if retried.
+    """
+
+@dataclass
+class Record:
+    location: str
+    project: str
+    applicant: comment.Applicant
+    meta: comment.Meta
+    approved: bool = False
+    comments: List[str] = field(default_factory=list)
+    dest: str = ""
+
+@dataclass
+class Survey:
+    """GIS results for a single parcel."""
+    parcel: esri.ParcelData
+    flood: Set[str]
+    zone: Optional[esri.Zone]
+    streets: List[esri.Street]
+
+    def master(self, meta: comment.Meta) -> comment.Master:
+        return comment.Master(meta, self.parcel, self.streets, self.flood, self.zone)
+
+    def to_bytes(self) -> bytes:
+        w = codec.Writer(codec.SURVEY)
+        w.blob(self.master(comment.Meta()).to_bytes())
+        return w.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'Survey':
+        m = comment.Master.from_bytes(codec.Reader(data, codec.SURVEY).blob())
+        return cls(m.parcel, m.flood, m.zone, m.streets)
+
+# CODECS
+# The job store and review history keep surveys as JSON.
+
+def encode_parcel(parcel: esri.ParcelData) -> Dict[str,Any]:
+    return asdict(parcel)
+
+def decode_parcel(data: Dict[str,Any]) -> esri.ParcelData:
+    return esri.ParcelData(data['location'], data['ring'], data['acres'], esri.Envelope(**data['envelope']))
+
+def encode_layers(flood: Set[str], zone: Optional[esri.Zone], streets: List[esri.Street]) -> Dict[str,Any]:
+    return {
+        "flood": sorted(flood),
+        "zone": asdict(zone) if zone else None,
+        "streets": [asdict(s) for s in streets],
+    }
+
+def decode_survey(parcel: esri.ParcelData, data: Dict[str,Any]) -> Survey:
+    zone = esri.Zone(**data['zone']) if data['zone'] else None
+    streets = [esri.Street(**s) for s in data['streets']]
+    return Survey(parcel, set(data['flood']), zone, streets)
+
+# END CODECS
+
+def record_from_dict(data: Dict[str,Any], default_dest: str="comments.pdf") -> Record:
+    """Builds a `Record` from a decoded JSON object in the batch line format."""
+    return Record(
+        data['location'],
+        data.get('project', ''),
+        comment.Applicant(**data['applicant']),
+        comment.Meta(**data.get('meta', {})),
+        data.get('approved', False),
+        data.get('comments', []),
+        data.get('dest') or default_dest,
+    )
+
+def load_records(path: str) -> List[Record]:
+    """Reads batch records from a JSON lines file. Blank lines are ignored.
+    Records without a `dest` are written to a letter named after their line
+    number and project, so records for the same project do not overwrite one
+    another.
+    """
+    records = []
+    with open(path) as f:
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            data = json.loads(line)
+            project = data.get('project')
+            dest = f"{n} {project} comments.pdf" if project else f"{n} comments.pdf"
+            records.append(record_from_dict(data, dest))
+    return records
+
+def location_key(location: str) -> str:
+    """Normalizes an address or parcel ID for use as a cache key."""
+    return ' '.join(location.upper().split())
+
+def locate(location: str, index: Optional[esri.ParcelIndex]=None) -> Optional[esri.ParcelData]:
+    """Finds a parcel by address or parcel ID, as the command line does.
+    Addresses inside a parcel already in `index` are resolved without a parcel
+    query, and parcels found are added to it.
+    """
+    if ' ' in location: # it's an address
+        loc = esri.geocode(location)
+        if loc is None:
+            log.warning(f"Cannot geocode {location}")
+            return None
+        return esri.fetch_parcel_at(loc, index)
+    parcel = esri.fetch_parcel(esri.params_from_pid(location))
+    if parcel is not None and index is not None:
+        index.add(parcel)
+    return parcel
+
+def buffer(ring: List[List[float]]) -> List[List[float]]:
+    """Buffers a parcel ring by `BUFFER` to find nearby streets."""
+    return esri.ParcelCollection([ring]).buffers(BUFFER).rings()[0]
+
+def process_pool(workers: Optional[int]=None) -> ProcessPoolExecutor:
+    """Creates the worker pool for CPU bound stages. Workers are spawned rather
+    than forked since the parent has GIS query threads running, and forking
+    while another thread holds a lock can deadlock the child.
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+def render_comments(master: comment.Master, record: Record) -> List[str]:
+    """Renders the base comments for a record followed by its special comments."""
+    return comment.generate_base_comments(master) + record.comments
+
+def write_letter(comments: List[str], record: Record, optimize: bool=False) -> str:
+    """Writes the PDF letter for a record, returning its path."""
+    letter = pdf.generate(comments, asdict(record.applicant), record.project, record.approved, optimize)
+    pdf.save(letter, record.dest)
+    return record.dest
+
+async def survey(location: str, network: Optional[esri.StreetNetwork]=None, index: Optional[esri.ParcelIndex]=None) -> Optional[Survey]:
+    """Runs every GIS query for a location, each in its own thread. With a
+    `network`, streets are found by their frontage on the parcel instead of
+    querying a buffered ring. Parcels are looked up in `index` before the
+    server. Returns `None` if the parcel could not be found. Raises
+    `LayerError` if the flood hazard, zoning or street query failed, so an
+    outage is never mistaken for a parcel outside every flood zone or away
+    from any street, nor for a location without a parcel.
+    """
+    parcel = await asyncio.to_thread(locate, location, index)
+    if parcel is None:
+        log.warning(f"No parcel found for {location}")
+        return None
+    if network is None:
+        streets = asyncio.to_thread(esri.trans, buffer(parcel.ring))
+    else:
+        streets = asyncio.to_thread(esri.trans, parcel.ring, network)
+    floodhaz, zoning, streets = await asyncio.gather(
+        asyncio.to_thread(esri.floodmap, parcel.ring),
+        asyncio.to_thread(esri.zoning, parcel.ring),
+        streets,
+    )
+    if floodhaz is None:
+        raise LayerError(f"flood hazard query failed for {location}")
+    if zoning is None:
+        raise LayerError(f"zoning query failed for {location}")
+    if streets is None:
+        raise LayerError(f"street query failed for {location}")
+    return Survey(parcel, floodhaz, zoning, streets)
+
+def review_pipeline(pool: Executor, concurrency: int=8, workers: int=4, writers: int=2, optimize: bool=False, network: Optional[esri.StreetNetwork]=None, index: Optional[esri.ParcelIndex]=None) -> pipeline.Pipeline:
+    """Builds the three stage review pipeline: `concurrency` records querying
+    the GIS servers, `workers` rendering comments and `writers` writing PDF
+    letters. Rendering and writing run in `pool`.
+    """
+    loop = asyncio.get_running_loop()
+    async def gis(record: Record) -> Optional[Tuple[Record, comment.Master]]:
+        result = await survey(record.location, network, index)
+        if result is None:
+            return None
+        return record, result.master(record.meta)
+    async def rendered(item: Tuple[Record, comment.Master]) -> Tuple[Record, List[str]]:
+        record, master = item
+        return record, await loop.run_in_executor(pool, render_comments, master, record)
+    async def written(item: Tuple[Record, List[str]]) -> str:
+        record, comments = item
+        return await loop.run_in_executor(pool, write_letter, comments, record, optimize)
+    return pipeline.Pipeline([
+        pipeline.Stage("gis", gis, concurrency),
+        pipeline.Stage("render", rendered, workers),
+        pipeline.Stage("write", written, writers),
+    ], describe=lambda record: record.location)
+
+def print_stats(stats: Dict[str,Dict[str,Any]]) -> ():
+    print(' | '.join(
+        f"{name}: {s['queued']} queued, {s['busy']}/{s['workers']} busy, {s['done']} done, {s['failed']} failed, {s['per_second']:.1f}/s"
+        for name, s in stats.items()
+    ))
+
+async def run(records: Iterable[Record], workers: Optional[int]=None, concurrency: int=8, optimize: bool=False, frontage: bool=False, writers: int=2, report: Optional[Callable[[Dict[str,Dict[str,Any]]], Any]]=None, interval: float=5.0) -> List[Optional[str]]:
+    """Reviews all records through `review_pipeline`. At most `concurrency`
+    records wait on the GIS servers at once, comments are rendered by
+    `workers` processes (one per core by default) and letters are written by
+    `writers` more. Parcels are shared between records through an
+    `esri.ParcelIndex`, so addresses in the same development are resolved
+    without another parcel query. With `frontage`, street centerlines are
+    shared through one `esri.StreetNetwork`. `report` receives the pipeline
+    stats every `interval` seconds. Results are in the same order as
+    `records`; failed reviews are `None`.
+    """
+    workers = workers or os.cpu_count() or 1
+    network = esri.StreetNetwork() if frontage else None
+    index = esri.ParcelIndex()
+    with process_pool(workers + writers) as pool:
+        stages = review_pipeline(pool, concurrency, workers, writers, optimize, network, index)
+        return await stages.run(records, report, interval)
+
+async def main(argv: List[str]) -> ():
+    parser = argparse.ArgumentParser(prog="planreview batch")
+    parser.add_argument("records", nargs="?", help="JSON lines file of submittals")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="records querying GIS servers at once")
+    parser.add_argument("--writers", type=int, default=2, help="letters written at once")
+    parser.add_argument("--progress", type=float, default=None, metavar="SECONDS", help="print stage stats this often")
+    parser.add_argument("--optimize", action="store_true", help="write optimised PDF letters")
+    parser.add_argument("--frontage", action="store_true", help="find streets by measured frontage instead of a buffer")
+    parser.add_argument("--store", help="SQLite job store to queue records in and resume from")
+    parser.add_argument("--max-attempts", type=int, default=3, help="give up on a stored job after this many failures")
+    args = parser.parse_args(argv)
+    if args.store:
+        from . import jobs # jobs depends on this module
+        store = jobs.JobStore(args.store)
+        if args.records:
+            added = store.add(load_records(args.records))
+            print(f"queued {added} new records in {args.store}")
+        summary = await jobs.run(store, args.workers, args.concurrency, args.max_attempts, args.optimize)
+        store.close()
+        print(' '.join(f"{stage}: {n}" for stage, n in summary.items()))
+        return
+    if not args.records:
+        parser.error("a records file is required without --store")
+    records = load_records(args.records)
+    report = print_stats if args.progress else None
+    results = await run(records, args.workers, args.concurrency, args.optimize, args.frontage, args.writers, report, args.progress or 5.0)
+    failed = [r.location for r, dest in zip(records, results) if dest is None]
+    print(f"reviewed {len(records) - len(failed)} of {len(records)} records")
+    for location in failed:
+        print(f"failed: {location}")
@@ -0,0 +1,116 @@
+"""## codec
+
+codec holds the primitives for the compact binary encoding of review data.
+`esri` and `comment` types implement `to_bytes` and `from_bytes` with them.
+
+Every encoded value starts with two bytes, the encoding `VERSION` and a tag for
+the type, so stale or mismatched data is rejected rather than misread. Numbers
+are little-endian, strings are length-prefixed UTF-8 and rings are stored as a
+vertex count followed by contiguous float64 x-y pairs. Nested values are
+embedded as length-prefixed blobs.
+"""
+
+import array
+import itertools
+import struct
+import sys
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+VERSION = 1
+
+ENVELOPE = 1
+PARCEL = 2
+STREET = 3
+ZONE = 4
+MASTER = 5
+SURVEY = 6
+
+NONE = -1
+
+class Writer:
+    def __init__(self, tag: int):
+        self.parts = [struct.pack('<BB', VERSION, tag)]
+
+    def pack(self, fmt: str, *values) -> ():
+        self.parts.append(struct.pack('<' + fmt, *values))
+
+    def str(self, value: Optional[str]) -> ():
+        if value is None:
+            self.pack('i', NONE)
+            return
+        data = value.encode('utf-8')
+        self.pack('i', len(data))
+        self.parts.append(data)
+
+    def strs(self, values: Optional[List[Optional[str]]]) -> ():
+        if values is None:
+            self.pack('i', NONE)
+            return
+        self.pack('i', len(values))
+        for value in values:
+            self.str(value)
+
+    def ring(self, ring) -> ():
+        if isinstance(ring, np.ndarray):
+            coords = np.ascontiguousarray(ring, dtype='<f8').tobytes()
+        else: # array is quicker than numpy at flattening nested lists
+            flat = array.array('d', itertools.chain.from_iterable(ring))
+            if sys.byteorder == 'big':
+                flat.byteswap()
+            coords = flat.tobytes()
+        self.pack('I', len(coords) // 16)
+        self.parts.append(coords)
+
+    def blob(self, data: bytes) -> ():
+        self.pack('I', len(data))
+        self.parts.append(data)
+
+    def getvalue(self) -> bytes:
+        return b''.join(self.parts)
+
+class Reader:
+    def __init__(self, data: bytes, tag: int):
+        self.data = memoryview(data)
+        self.pos = 0
+        version, found = self.unpack('BB')
+        if version != VERSION:
+            raise ValueError(f"unsupported encoding version {version}")
+        if found != tag:
+            raise ValueError(f"expected type tag {tag}, found {found}")
+
+    def unpack(self, fmt: str) -> Tuple:
+        fmt = '<' + fmt
+        chunk = self.take(struct.calcsize(fmt))
+        return struct.unpack(fmt, chunk)
+
+    def take(self, n: int) -> memoryview:
+        """Returns the next `n` bytes. Raises `ValueError` if the data ends
+        first, as it does when a blob was truncated.
+        """
+        if n < 0 or n > len(self.data) - self.pos:
+            raise ValueError(f"expected {n} bytes at offset {self.pos}, found {len(self.data) - self.pos}")
+        chunk = self.data[self.pos:self.pos+n]
+        self.pos += n
+        return chunk
+
+    def str(self) -> Optional[str]:
+        n, = self.unpack('i')
+        if n == NONE:
+            return None
+        return str(self.take(n), 'utf-8')
+
+    def strs(self) -> Optional[List[Optional[str]]]:
+        n, = self.unpack('i')
+        if n == NONE:
+            return None
+        return [self.str() for _ in range(n)]
+
+    def ring(self) -> np.ndarray:
+        n, = self.unpack('I')
+        return np.frombuffer(self.take(16*n), dtype='<f8').reshape(n, 2)
+
+    def blob(self) -> bytes:
+        n, = self.unpack('I')
+        return bytes(self.take(n))
@@ -28,10 +28,11 @@ will provide the necessary content in a digestible format.
 """
 
 from jinja2 import Environment, PackageLoader
-from dataclasses import dataclass
+from dataclasses import dataclass, asdict
 from typing import List, Set, Dict, Optional
 import logging
 
+from . import codec
 from . import esri
 from . import pdf
 
@@ -62,6 +63,32 @@ class Master:
     flood: Set[str]
     zone: esri.Zone
 
+    def to_bytes(self) -> bytes:
+        m = self.meta
+        w = codec.Writer(codec.MASTER)
+        w.pack('5?', m.subdivision, m.grading, m.franchise, m.wall, m.detention)
+        w.blob(self.parcel.to_bytes())
+        w.pack('I', len(self.streets))
+        for street in self.streets:
+            w.blob(street.to_bytes())
+        w.strs(sorted(self.flood) if self.flood is not None else None)
+        w.pack('?', self.zone is not None)
+        if self.zone is not None:
+            w.blob(self.zone.to_bytes())
+        return w.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'Master':
+        r = codec.Reader(data, codec.MASTER)
+        meta = Meta(*r.unpack('5?'))
+        parcel = esri.ParcelData.from_bytes(r.blob())
+        n, = r.unpack('I')
+        streets = [esri.Street.from_bytes(r.blob()) for _ in range(n)]
+        flood = r.strs()
+        has_zone, = r.unpack('?')
+        zone = esri.Zone.from_bytes(r.blob()) if has_zone else None
+        return cls(meta, parcel, streets, set(flood) if flood is not None else None, zone)
+
 # FILTERS #
 def permit_fee(acres: float) -> str:
     fee = min(60.0 * acres + 60.0,660.0)
@@ -98,8 +125,7 @@ def generate_email(comments: List[str], app: Applicant, approved: bool=False) ->
     log.debug(email_body)
     return email_body
 
-def generate_letter(comments: List[str],app: Applicant, project: str, dest: str="comment letter.pdf", approved: bool=False) -> ():
-    app = app.__dict__ # This is a kludge to avoid shadowing
-    letter = pdf.generate(comments, app, project, approved)
+def generate_letter(comments: List[str],app: Applicant, project: str, dest: str="comment letter.pdf", approved: bool=False, optimize: bool=False) -> ():
+    letter = pdf.generate(comments, asdict(app), project, approved, optimize)
     pdf.save(letter,dest)
 
@@ -22,14 +22,31 @@ returns a set of strings.
 """
 
 import requests
+import json
 import logging
+import math
+import threading
+import time
+from collections import OrderedDict
 from dataclasses import dataclass
 from copy import deepcopy
 from typing import List, Dict, Optional, Any, Tuple, Set
 import numpy as np
 
+from . import codec
+
+try: # orjson is optional and much faster at parsing large query results
+    import orjson
+except ImportError:
+    orjson = None
+
 log = logging.getLogger(__name__)
 
+# Shared by all queries so connections to the GIS servers are kept alive and
+# reused between reviews in long running processes.
+session = requests.Session()
+session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=32))
+
 @dataclass
 class Envelope:
     xmin: float
@@ -37,6 +54,15 @@ class Envelope:
     xmax: float
     ymax: float
 
+    def to_bytes(self) -> bytes:
+        w = codec.Writer(codec.ENVELOPE)
+        w.pack('4d', self.xmin, self.ymin, self.xmax, self.ymax)
+        return w.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'Envelope':
+        return cls(*codec.Reader(data, codec.ENVELOPE).unpack('4d'))
+
 
 @dataclass
 class ParcelData:
@@ -45,6 +71,29 @@ class ParcelData:
     acres: float
     envelope: Envelope
 
+    def to_bytes(self) -> bytes:
+        """Encodes the parcel compactly. Coordinates are stored as float64."""
+        w = codec.Writer(codec.PARCEL)
+        w.pack('?d', self.acres is not None, self.acres or 0.0)
+        w.pack('2d', self.location['x'], self.location['y'])
+        e = self.envelope
+        w.pack('4d', e.xmin, e.ymin, e.xmax, e.ymax)
+        w.ring(self.ring)
+        return w.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'ParcelData':
+        r = codec.Reader(data, codec.PARCEL)
+        has_acres, acres = r.unpack('?d')
+        x, y = r.unpack('2d')
+        envelope = Envelope(*r.unpack('4d'))
+        ring = r.ring().tolist()
+        return cls({'x': x, 'y': y}, ring, acres if has_acres else None, envelope)
+
+    def __reduce__(self):
+        # pickle the ring as one float64 buffer rather than a float per coordinate
+        return (ParcelData.from_bytes, (self.to_bytes(),))
+
 @dataclass
 class Street:
     name: str
@@ -53,12 +102,50 @@ class Street:
     alt: bool = False
     state: bool = False
 
+    def to_bytes(self) -> bytes:
+        w = codec.Writer(codec.STREET)
+        w.str(self.name)
+        w.str(self.classification)
+        w.pack('i??', self.row, self.alt, self.state)
+        return w.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'Street':
+        r = codec.Reader(data, codec.STREET)
+        return cls(r.str(), r.str(), *r.unpack('i??'))
+
+@dataclass
+class Features:
+    """Query results reduced to the attributes a caller asked for, stored as
+    one list per field in feature order. If geometry was requested, `rings`
+    holds each feature's rings (or polyline paths) as float64 arrays of x-y
+    pairs.
+    """
+    attributes: Dict[str,List[Any]]
+    rings: Optional[List[List[np.ndarray]]] = None
+    exceeded: bool = False
+
+    def __len__(self) -> int:
+        return len(next(iter(self.attributes.values()), self.rings or []))
+
 @dataclass
 class Zone:
     classification: str
     overlays: Optional[List[str]]
     cases: Optional[List[str]]
 
+    def to_bytes(self) -> bytes:
+        w = codec.Writer(codec.ZONE)
+        w.str(self.classification)
+        w.strs(self.overlays)
+        w.strs(self.cases)
+        return w.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'Zone':
+        r = codec.Reader(data, codec.ZONE)
+        return cls(r.str(), r.strs(), r.strs())
+
 def geocode(address: str) -> Optional[Dict[str,float]]:
     """Returns northing and easting of a parcel by address. Coordinates returned
     are state plan for Arkansas North.    
@@ -74,7 +161,7 @@ def geocode(address: str) -> Optional[Dict[str,float]]:
             "latestWkid": 3433,
         },
     }
-    response = requests.get(url, params=params)
+    response = session.get(url, params=params)
     log.debug(f"HTTP GET:\t{response.url}")
     data = server_ok(response, "Geolocator")
     if not data:
@@ -145,18 +232,18 @@ def fetch_parcel(params: Dict[str,Any]) -> Optional[ParcelData]:
     """
     url = "https://pagis.org/arcgis/rest/services/APPS/OperationalLayers/MapServer/51/query"
 
-    response = requests.get(url, params=params)
-    data = server_ok(response, "Parcel")
-    if not data:
+    response = session.get(url, params=params)
+    features = server_features(response, "Parcel", ["CALC_ACRE"], geometry=True)
+    if features is None:
         return None
     try:
-        ring = data["features"][0]['geometry']['rings'][0]
+        ring = features.rings[0][0].tolist()
         if len(ring) < 3:
             raise ValueError("Ring has less than three points")
         log.debug(f"ring: {ring}")
         center = centroid(ring)
         log.debug(f"centroid: {centroid}")
-        acres = data["features"][0]['attributes']['CALC_ACRE']
+        acres = features.attributes['CALC_ACRE'][0]
         log.debug(f"acres: {acres}")
         envelope = make_envelope(ring)
         log.debug(f"Envelope: ({envelope.xmin},{envelope.ymin}),({envelope.xmax},{envelope.ymax})")
@@ -165,8 +252,304 @@ def fetch_parcel(params: Dict[str,Any]) -> Optional[ParcelData]:
         log.warning(f"failed to find unmarshal parcel data with error {e}")
         return None
 
+class ParcelIndex:
+    """Parcels already fetched, kept so a geocoded point can be resolved to its
+    parcel without a query. Lookups prefilter on envelopes and then test the
+    candidate rings exactly. With a `size`, the oldest parcels are dropped once
+    the index is full, and with a `ttl`, parcels fetched more than `ttl`
+    seconds ago are dropped so re-platted lots are fetched again. An index is
+    safe to share between threads.
+    """
+    def __init__(self, size: Optional[int]=None, ttl: Optional[float]=None):
+        self.size = size
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._parcels: Optional[List[ParcelData]] = None
+        self._envelopes: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._expire()
+            return len(self._data)
+
+    def _expire(self) -> ():
+        """Drops parcels past their `ttl`, oldest first. Callers hold the lock."""
+        if self.ttl is None:
+            return
+        now = time.monotonic()
+        while self._data and now - next(iter(self._data.values()))[0] > self.ttl:
+            self._data.popitem(last=False)
+            self._parcels = None
+
+    def add(self, parcel: ParcelData) -> ():
+        e = parcel.envelope
+        key = (e.xmin, e.ymin, e.xmax, e.ymax)
+        with self._lock:
+            self._expire()
+            if key in self._data:
+                return
+            self._data[key] = (time.monotonic(), parcel)
+            while self.size is not None and len(self._data) > self.size:
+                self._data.popitem(last=False)
+            self._parcels = None
+
+    def find(self, location: Dict[str,float]) -> Optional[ParcelData]:
+        """Returns the indexed parcel containing an `x`-`y` location, if any."""
+        x, y = location['x'], location['y']
+        with self._lock:
+            self._expire()
+            if self._parcels is None:
+                self._parcels = [parcel for _, parcel in self._data.values()]
+                self._envelopes = np.array([[p.envelope.xmin, p.envelope.ymin, p.envelope.xmax, p.envelope.ymax] for p in self._parcels]).reshape(-1, 4)
+            parcels, envelopes = self._parcels, self._envelopes
+        candidates = np.flatnonzero(
+            (envelopes[:, 0] <= x) & (x <= envelopes[:, 2]) & (envelopes[:, 1] <= y) & (y <= envelopes[:, 3])
+        )
+        for i in candidates:
+            if points_in_ring(parcels[i].ring, [[x, y]])[0]:
+                return parcels[i]
+        return None
+
+def fetch_parcel_at(location: Dict[str,float], index: Optional[ParcelIndex]=None) -> Optional[ParcelData]:
+    """Finds the parcel at a geocoded location, answering from `index` when a
+    parcel there has already been fetched and querying PAGIS on a miss. Parcels
+    fetched are added to the index.
+    """
+    if index is not None:
+        parcel = index.find(location)
+        if parcel is not None:
+            log.debug(f"parcel for {location} found in index")
+            return parcel
+    parcel = fetch_parcel(params_from_loc(location))
+    if parcel is not None and index is not None:
+        index.add(parcel)
+    return parcel
+
+def params_from_ring(ring: List[List[float]], page_size: int=1000) -> Dict[str,Any]:
+    """Creates query parameters for the PAGIS parcel map server to find every
+    parcel intersecting a ring geometry, such as a subdivision boundary. Results
+    are ordered by parcel ID so they can be paged with `fetch_parcels`.
+    """
+    geometry = {
+        "rings": [[[float(x), float(y)] for x, y in ring]],
+        "spatialReference": {"wkid": 102651, "latestWkid": 3433},
+    }
+    params = {
+        "f": "json",
+        "spatialRel": "esriSpatialRelIntersects",
+        "geometry": json.dumps(geometry, separators=(',', ':')),
+        "geometryType": "esriGeometryPolygon",
+        "inSR": 102651,
+        "outSR": 102651,
+        "outFields": "CALC_ACRE,PARCEL_ID",
+        "returnGeometry": "true",
+        "orderByFields": "PARCEL_ID",
+        "resultRecordCount": page_size,
+    }
+    return params
+
+def fetch_parcels(params: Dict[str,Any]) -> Optional[List[ParcelData]]:
+    """Queries PAGIS for every parcel matching `params`, which should be the
+    result of `params_from_ring`, following pages until the server has no more.
+    Envelopes and centroids are computed for all parcels at once.
+    """
+    url = "https://pagis.org/arcgis/rest/services/APPS/OperationalLayers/MapServer/51/query"
+    rings = []
+    acres = []
+    offset = 0
+    while True:
+        response = session.get(url, params={**params, "resultOffset": offset})
+        features = server_features(response, "Parcel", ["CALC_ACRE"], geometry=True)
+        if features is None:
+            return None
+        for feature_rings, area in zip(features.rings, features.attributes["CALC_ACRE"]):
+            if not feature_rings or len(feature_rings[0]) < 3:
+                log.debug("skipping parcel without a usable ring")
+                continue
+            rings.append(feature_rings[0])
+            acres.append(area)
+        offset += len(features)
+        log.debug(f"fetched {offset} parcels")
+        if not features.exceeded or not len(features):
+            break
+    if not rings:
+        return []
+    collection = ParcelCollection(rings)
+    envelopes = collection.envelopes()
+    centers = collection.centroids()
+    parcels = []
+    for ring, area, (x, y), (xmin, ymin, xmax, ymax) in zip(rings, acres, centers.tolist(), envelopes.tolist()):
+        parcels.append(ParcelData({'x': x, 'y': y}, ring.tolist(), area, Envelope(xmin, ymin, xmax, ymax)))
+    return parcels
+
 # GEOMETRY FUNCTION
 
+def ring_envelopes(rings: List[np.ndarray]) -> np.ndarray:
+    """Calculates `make_envelope` for many rings in one pass. Returns an array
+    of `[xmin, ymin, xmax, ymax]` rows.
+    """
+    return ParcelCollection(rings).envelopes()
+
+def ring_centroids(rings: List[np.ndarray]) -> np.ndarray:
+    """Calculates `centroid` for many rings in one pass. Returns an array of
+    `[x, y]` rows.
+    """
+    return ParcelCollection(rings).centroids()
+
+# Longest a buffered corner may reach from its vertex, in multiples of the
+# buffer distance. Sharper corners are cut short.
+MITER_LIMIT = 4.0
+
+class ParcelCollection:
+    """Many rings stored as one float64 array of x-y pairs, with the offset at
+    which each ring starts, so geometry for every ring is computed in a single
+    vectorized pass. Every ring needs at least one vertex; rings may be given
+    closed (last vertex repeating the first) or open.
+    """
+    def __init__(self, rings):
+        arrays = [np.asarray(r, dtype=np.float64).reshape(-1, 2) for r in rings]
+        self.counts = np.array([len(a) for a in arrays], dtype=np.intp)
+        self.offsets = np.concatenate(([0], np.cumsum(self.counts))).astype(np.intp)
+        self.coords = np.concatenate(arrays) if arrays else np.empty((0, 2))
+
+    @classmethod
+    def from_parcels(cls, parcels: List[ParcelData]) -> 'ParcelCollection':
+        return cls([p.ring for p in parcels])
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def ring(self, i: int) -> np.ndarray:
+        return self.coords[self.offsets[i]:self.offsets[i+1]]
+
+    def rings(self) -> List[List[List[float]]]:
+        return [self.ring(i).tolist() for i in range(len(self))]
+
+    def _next(self) -> np.ndarray:
+        """Index of the vertex following each vertex within its ring."""
+        starts = np.repeat(self.offsets[:-1], self.counts)
+        counts = np.repeat(self.counts, self.counts)
+        local = np.arange(len(self.coords)) - starts
+        return starts + (local + 1) % counts
+
+    def envelopes(self) -> np.ndarray:
+        """Returns `[xmin, ymin, xmax, ymax]` rows, as `make_envelope`."""
+        if not len(self):
+            return np.empty((0, 4))
+        starts = self.offsets[:-1]
+        mins = np.minimum.reduceat(self.coords, starts, axis=0)
+        maxs = np.maximum.reduceat(self.coords, starts, axis=0)
+        return np.hstack((mins, maxs))
+
+    def centroids(self) -> np.ndarray:
+        """Returns `[x, y]` rows of vertex means, as `centroid`."""
+        if not len(self):
+            return np.empty((0, 2))
+        return np.add.reduceat(self.coords, self.offsets[:-1], axis=0) / self.counts[:, None]
+
+    def signed_areas(self) -> np.ndarray:
+        """Returns the shoelace area of each ring, positive for rings wound
+        counter-clockwise.
+        """
+        if not len(self):
+            return np.empty(0)
+        x, y = self.coords[:, 0], self.coords[:, 1]
+        nxt = self._next()
+        return np.add.reduceat(x*y[nxt] - x[nxt]*y, self.offsets[:-1]) / 2
+
+    def areas(self) -> np.ndarray:
+        """Returns the area of each ring in square units of the coordinates."""
+        return np.abs(self.signed_areas())
+
+    def acres(self) -> np.ndarray:
+        """Returns the area of each ring in acres, for rings in State Plane feet."""
+        return self.areas() / 43560.0
+
+    def opened(self) -> 'ParcelCollection':
+        """Returns the collection with the closing vertex of closed rings dropped."""
+        lasts = self.offsets[1:] - 1
+        closed = (self.counts > 1) & np.all(self.coords[self.offsets[:-1]] == self.coords[lasts], axis=1)
+        keep = np.ones(len(self.coords), dtype=bool)
+        keep[lasts[closed]] = False
+        result = ParcelCollection([])
+        result.coords = self.coords[keep]
+        result.counts = self.counts - closed
+        result.offsets = np.concatenate(([0], np.cumsum(result.counts))).astype(np.intp)
+        return result
+
+    def buffers(self, buffer: float, limit: float=MITER_LIMIT) -> 'ParcelCollection':
+        """Offsets every edge outward by `buffer` and joins the offset edges
+        with mitered corners, for all rings at once. A vertex moves by
+        `buffer*(n1+n2)/(1+n1.n2)` for the unit normals of the edges meeting
+        there, so vertices on a straight edge move by exactly `buffer`, and
+        no corner reaches further than `limit` times `buffer`. The outward
+        side is taken from each ring's winding. Rings are returned closed.
+        """
+        rings = self.opened()
+        coords = rings.coords
+        nxt = rings._next()
+        prv = np.empty_like(nxt)
+        prv[nxt] = np.arange(len(nxt))
+        # outward normal of each edge leaving a vertex
+        d = coords[nxt] - coords
+        with np.errstate(divide='ignore', invalid='ignore'):
+            normals = np.stack((d[:, 1], -d[:, 0]), axis=1) / np.linalg.norm(d, axis=1)[:, None]
+        normals = np.nan_to_num(normals)
+        winding = np.where(rings.signed_areas() < 0, -1.0, 1.0)
+        normals *= np.repeat(winding, rings.counts)[:, None]
+        # 1+n1.n2 is 2cos^2 of half the turn; clamping it caps the miter
+        # length buffer/cos at `limit` times the buffer
+        miter = 1.0 + np.einsum('ij,ij->i', normals, normals[prv])
+        np.maximum(miter, 2.0/limit**2, out=miter)
+        moved = coords + buffer*(normals + normals[prv])/miter[:, None]
+        result = ParcelCollection([])
+        result.coords = np.insert(moved, rings.offsets[1:], moved[rings.offsets[:-1]], axis=0)
+        result.counts = rings.counts + 1
+        result.offsets = np.concatenate(([0], np.cumsum(result.counts))).astype(np.intp)
+        return result
+
+    def contains(self, points, chunk: int=1<<22) -> np.ndarray:
+        """Finds the ring containing each `[x,y]` point using the even-odd
+        rule, after prefiltering on envelopes. Returns the index of the first
+        containing ring for each point, or -1. Points are tested in chunks of
+        at most `chunk` point-ring pairs to bound memory.
+        """
+        pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        found = np.full(len(pts), -1, dtype=np.intp)
+        if not len(self) or not len(pts):
+            return found
+        env = self.envelopes()
+        x1, y1 = self.coords[:, 0], self.coords[:, 1]
+        nxt = self._next()
+        x2, y2 = x1[nxt], y1[nxt]
+        step = max(1, chunk // len(self))
+        for lo in range(0, len(pts), step):
+            p = pts[lo:lo+step]
+            inside = (
+                (env[:, 0] <= p[:, 0, None]) & (p[:, 0, None] <= env[:, 2])
+                & (env[:, 1] <= p[:, 1, None]) & (p[:, 1, None] <= env[:, 3])
+            )
+            point, ring = np.nonzero(inside)
+            if not len(point):
+                continue
+            # one row per edge of each candidate ring
+            n = self.counts[ring]
+            pair = np.repeat(np.arange(len(point)), n)
+            edge = np.repeat(self.offsets[ring] - np.cumsum(n) + n, n) + np.arange(n.sum())
+            px, py = p[point[pair], 0], p[point[pair], 1]
+            straddles = (y1[edge] > py) != (y2[edge] > py)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                x_cross = x1[edge] + (py - y1[edge]) * (x2[edge] - x1[edge]) / (y2[edge] - y1[edge])
+            hits = (straddles & (px < x_cross)).astype(np.intp)
+            crossings = np.add.reduceat(hits, np.concatenate(([0], np.cumsum(n)[:-1])))
+            odd = crossings % 2 == 1
+            # pairs are in point order then ring order, so the first hit is the lowest ring
+            for_point = point[odd] + lo
+            first = np.unique(for_point, return_index=True)[1]
+            found[for_point[first]] = ring[odd][first]
+        return found
+
 def make_envelope(ring: List[List[float]]) -> Envelope:
     """Creates a rectangle enclosing an entire ring geometry."""
     xmin = min(n[0] for n in ring)
@@ -246,6 +629,54 @@ def is_outside(ring: List[List[float]], point: List[float]) -> bool:
     intersections = intersections - vertex_intersections/2
     return intersections % 2 == 0
 
+def points_in_ring(ring: List[List[float]], points) -> np.ndarray:
+    """Tests many `[x,y]` points against a ring at once using the even-odd
+    crossing rule, returning a boolean array which is `True` for points inside.
+    Points exactly on an edge may fall either way.
+    """
+    coords = np.asarray(ring, dtype=np.float64).reshape(-1, 2)
+    pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    x1, y1 = coords[:, 0, None], coords[:, 1, None]
+    x2, y2 = np.roll(coords[:, 0], -1)[:, None], np.roll(coords[:, 1], -1)[:, None]
+    px, py = pts[:, 0], pts[:, 1]
+    straddles = (y1 > py) != (y2 > py)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_cross = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+    crossings = np.count_nonzero(straddles & (px < x_cross), axis=0)
+    return crossings % 2 == 1
+
+def point_segment_distances(points: np.ndarray, segments: np.ndarray) -> np.ndarray:
+    """Returns the distance from each of `n` x-y points to each of `m`
+    segments given as `[x1,y1,x2,y2]` rows, as an `(n,m)` array.
+    """
+    p = np.asarray(points, dtype=np.float64).reshape(-1, 1, 2)
+    segs = np.asarray(segments, dtype=np.float64).reshape(1, -1, 4)
+    a, ab = segs[..., :2], segs[..., 2:] - segs[..., :2]
+    length2 = (ab*ab).sum(-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(length2 > 0, ((p - a)*ab).sum(-1) / length2, 0.0)
+    closest = a + np.clip(t, 0.0, 1.0)[..., None]*ab
+    return np.linalg.norm(p - closest, axis=-1)
+
+def segment_distances(p: np.ndarray, q: np.ndarray) -> np.ndarray:
+    """Returns the minimum distance between each of the `n` segments in `p`
+    and each of the `m` segments in `q`, both given as `[x1,y1,x2,y2]` rows,
+    as an `(n,m)` array. Crossing segments are zero apart.
+    """
+    p = np.asarray(p, dtype=np.float64).reshape(-1, 4)
+    q = np.asarray(q, dtype=np.float64).reshape(-1, 4)
+    # segments which do not cross are closest at one of the four endpoints
+    dist = np.minimum(
+        np.minimum(point_segment_distances(p[:, :2], q), point_segment_distances(p[:, 2:], q)),
+        np.minimum(point_segment_distances(q[:, :2], p), point_segment_distances(q[:, 2:], p)).T,
+    )
+    a, b = p[:, None, :2], p[:, None, 2:]
+    c, d = q[None, :, :2], q[None, :, 2:]
+    def orient(o, s, e):
+        return (s[..., 0] - o[..., 0])*(e[..., 1] - o[..., 1]) - (s[..., 1] - o[..., 1])*(e[..., 0] - o[..., 0])
+    crosses = (orient(a, b, c)*orient(a, b, d) < 0) & (orient(c, d, a)*orient(c, d, b) < 0)
+    return np.where(crosses, 0.0, dist)
+
 def point_slope(a,b:List[float]) -> Tuple[float,float]:
     """Returns the slope and y-intercept of a line drawn between two points
     given as x,y coordinates. Return values are intended to be used for point-
@@ -315,40 +746,65 @@ def in_domain(intersect, p1, p2, o1, o2:List[float]) -> bool:
 
 # END GEOMETRY
 
-def trans(ring: List[float]) -> List[Street]:
+# Right-of-way width in feet by Master Street Plan classification.
+STREET_ROW = {
+    "minor residential": 45,
+    "residential": 50,
+    "collector": 60,
+    "commercial": 60,
+    "minor arterial": 90,
+    "principal arterial": 110,
+}
+
+STATE_HIGHWAYS = {
+    "INTERSTATE 30",
+    "INTERSTATE 430",
+    "INTERSTATE 440",
+    "INTERSTATE 530",
+    "INTERSTATE 630",
+    "CANTRELL RD",
+    "BROADWAY ST",
+    "W ROOSEVELT RD",
+    "S UNIVERSITY AVE",
+    "N UNIVERSITY AVE",
+    "BASELINE RD",
+    "S ARCH ST",
+    "STAGECOACH RD",
+    "COLONEL GLENN RD",
+}
+
+STREET_PLAN = "https://maps.littlerock.state.ar.us/arcgis/rest/services/Master_Street_Plan/MapServer/0/query"
+
+# Distance beyond half the right-of-way a property line may sit from the
+# centerline and still front the street.
+FRONTAGE_SLACK = 25.0
+
+def make_street(name: str, alt: Optional[str], scadd: str) -> Street:
+    """Builds a `Street` from Master Street Plan attributes."""
+    classification = scadd.lower()
+    return Street(name, classification, STREET_ROW.get(classification, 50), alt is not None, name in STATE_HIGHWAYS)
+
+def trans(ring: List[float], network: Optional['StreetNetwork']=None) -> Optional[List[Street]]:
     """Queries the City of Little Rock transportation plan map for streets 
     contained within the queried ring. The ring supplied should be buffered to
     include the maximum probable distance a street centerline may be from the
     property.
 
+    If a `StreetNetwork` is given, `ring` should be the unbuffered parcel ring
+    and only the streets which front it are returned, measured against the
+    centerlines cached by the network.
+
     This function returns an array of `Street` objects, which have the street
-    name, classification and alternative-design flag.
+    name, classification and alternative-design flag, or `None` if the query
+    failed.
     """
-    classify = {
-        "minor residential": 45,
-        "residential": 50,
-        "collector": 60,
-        "commercial": 60,
-        "minor arterial": 90,
-        "principal arterial": 110,
-    }
-    state_highway = {
-        "INTERSTATE 30",
-        "INTERSTATE 430",
-        "INTERSTATE 440",
-        "INTERSTATE 530",
-        "INTERSTATE 630",
-        "CANTRELL RD",
-        "BROADWAY ST",
-        "W ROOSEVELT RD",
-        "S UNIVERSITY AVE",
-        "N UNIVERSITY AVE",
-        "BASELINE RD",
-        "S ARCH ST",
-        "STAGECOACH RD",
-        "COLONEL GLENN RD",
-    }
-    url = "https://maps.littlerock.state.ar.us/arcgis/rest/services/Master_Street_Plan/MapServer/0/query"
+    if network is not None:
+        fronting = network.frontage(ring)
+        if fronting is None:
+            return None
+        streets = [street for street, _ in fronting]
+        log.debug(f"streets fronting parcel: {fronting}")
+        return streets
     rings = {"rings": [ring]}.__repr__()
     params = {
         'f': 'json',
@@ -360,26 +816,213 @@ def trans(ring: List[float]) -> List[Street]:
         'maxAllowableOffset': 1,
         'outFields': "MapName,AltDes,SCADD_Type",
     }
-    resp = requests.get(url,params=params)
-    data = server_ok(resp, "Master Street Plan")
-    if not data:
-        return []
-    if not data.get('features'):
+    resp = session.get(STREET_PLAN,params=params)
+    features = server_features(resp, "Master Street Plan", ["MapName","AltDes","SCADD_Type"])
+    if features is None:
+        return None
+    if not len(features):
         log.debug(f"No streets founds for query:{resp.url}")
         return []
-    streets = []
-    for f in data['features']:
-        name = f['attributes']['MapName']
-        state = False
-        if name in state_highway:
-            state = True
-        classification = f['attributes']['SCADD_Type'].lower()
-        row = classify.get(classification,50)
-        is_alt = f['attributes'].get('AltDes') is not None
-        streets.append(Street(name,classification,row,is_alt,state))
+    columns = features.attributes
+    streets = [make_street(*attrs) for attrs in zip(columns['MapName'], columns['AltDes'], columns['SCADD_Type'])]
     log.debug(f"query:{resp.url}\nreturned streets:{streets}")
     return streets
 
+class StreetNetwork:
+    """Master Street Plan centerlines, fetched a square `tile` at a time and
+    kept per street feature so parcels near one another share a single query.
+    With a `size`, the oldest tiles are dropped once that many are loaded, and
+    with a `ttl`, tiles loaded more than `ttl` seconds ago are fetched again.
+    A network is safe to share between threads. Tiles are fetched outside the
+    lock, each by one thread at a time, and only added to the network once
+    every page has been fetched.
+    """
+    def __init__(self, tile: float=2000.0, size: Optional[int]=None, ttl: Optional[float]=None):
+        self.tile = tile
+        self.size = size
+        self.ttl = ttl
+        self.tiles: OrderedDict = OrderedDict()
+        self.features: Dict[Any, Tuple[Street, np.ndarray]] = {}
+        self._index = None
+        self._loading: Dict[Tuple[int,int], threading.Event] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def segments(paths: List[np.ndarray]) -> np.ndarray:
+        """Returns centerline paths as segment rows of `[x1,y1,x2,y2]`."""
+        segments = [np.hstack((p[:-1], p[1:])) for p in paths if len(p) > 1]
+        return np.vstack(segments) if segments else np.empty((0, 4))
+
+    def add(self, key: Any, street: Street, paths: List[np.ndarray]) -> ():
+        """Adds a street feature's centerline paths. Features already present
+        are ignored.
+        """
+        segments = self.segments(paths)
+        with self._lock:
+            if key not in self.features:
+                self.features[key] = (street, segments)
+                self._index = None
+
+    def _expire(self) -> ():
+        """Drops tiles past their `ttl` or beyond `size`, oldest first, along
+        with features no remaining tile holds. Callers hold the lock.
+        """
+        now = time.monotonic()
+        dropped = set()
+        while self.tiles and (
+            (self.ttl is not None and now - next(iter(self.tiles.values()))[0] > self.ttl)
+            or (self.size is not None and len(self.tiles) > self.size)
+        ):
+            dropped |= self.tiles.popitem(last=False)[1][1]
+        if dropped:
+            for _, keys in self.tiles.values():
+                dropped -= keys
+            for key in dropped:
+                self.features.pop(key, None)
+            self._index = None
+
+    def load(self, envelope: Envelope) -> bool:
+        """Fetches centerlines for every tile overlapping `envelope` which has
+        not been loaded yet, waiting for tiles another thread is fetching.
+        Returns `False` if a query failed.
+        """
+        t = self.tile
+        wanted = {
+            (i, j)
+            for i in range(math.floor(envelope.xmin/t), math.floor(envelope.xmax/t) + 1)
+            for j in range(math.floor(envelope.ymin/t), math.floor(envelope.ymax/t) + 1)
+        }
+        mine, theirs = [], []
+        with self._lock:
+            self._expire()
+            for tile in sorted(wanted):
+                if tile in self.tiles:
+                    continue
+                if tile in self._loading:
+                    theirs.append((tile, self._loading[tile]))
+                else:
+                    self._loading[tile] = threading.Event()
+                    mine.append(tile)
+        ok = True
+        for tile in mine:
+            fetched = None
+            try:
+                # after a failure the remaining tiles are released unfetched
+                if ok:
+                    fetched = self._fetch(tile)
+            finally:
+                with self._lock:
+                    if fetched is not None:
+                        for key, street, segments in fetched:
+                            self.features.setdefault(key, (street, segments))
+                        self.tiles[tile] = (time.monotonic(), {key for key, _, _ in fetched})
+                        self._index = None
+                        self._expire()
+                    self._loading.pop(tile).set()
+            ok = fetched is not None
+        for _, event in theirs:
+            event.wait()
+        with self._lock:
+            return ok and all(tile in self.tiles for tile, _ in theirs)
+
+    def _fetch(self, tile: Tuple[int,int]) -> Optional[List[Tuple[Any, Street, np.ndarray]]]:
+        """Returns every street feature in a tile as a key, `Street` and
+        segments, or `None` if a query failed.
+        """
+        i, j = tile
+        t = self.tile
+        fields = ["OBJECTID", "MapName", "AltDes", "SCADD_Type"]
+        params = {
+            'f': 'json',
+            'geometry': f"{i*t},{j*t},{(i+1)*t},{(j+1)*t}",
+            'geometryType': 'esriGeometryEnvelope',
+            'spatialRel': 'esriSpatialRelIntersects',
+            'inSR': 102651,
+            'outSR': 102651,
+            'maxAllowableOffset': 1,
+            'outFields': ','.join(fields),
+            'returnGeometry': 'true',
+            'orderByFields': 'OBJECTID',
+        }
+        fetched = []
+        while True:
+            resp = session.get(STREET_PLAN, params={**params, "resultOffset": len(fetched)})
+            features = server_features(resp, "Master Street Plan", fields, geometry=True)
+            if features is None:
+                return None
+            columns = features.attributes
+            for oid, name, alt, scadd, paths in zip(*(columns[f] for f in fields), features.rings):
+                key = oid if oid is not None else (name, tuple(paths[0][0]) if paths else None)
+                fetched.append((key, make_street(name, alt, scadd), self.segments(paths)))
+            if not features.exceeded or not len(features):
+                break
+        log.debug(f"tile {tile} has {len(fetched)} street features")
+        return fetched
+
+    def index(self) -> Tuple[np.ndarray, np.ndarray, List[Street]]:
+        """Returns every cached segment, the index of the street owning each
+        segment and the distinct streets. Segments are grouped by street.
+        """
+        with self._lock:
+            if self._index is not None:
+                return self._index
+            streets, keys, parts, owners = [], {}, [], []
+            for street, segments in self.features.values():
+                n = keys.setdefault((street.name, street.classification, street.alt, street.state), len(streets))
+                if n == len(streets):
+                    streets.append(street)
+                parts.append(segments)
+                owners.append(np.full(len(segments), n))
+            if not parts:
+                self._index = (np.empty((0, 4)), np.empty(0, dtype=int), [])
+            else:
+                owners = np.concatenate(owners)
+                order = np.argsort(owners, kind='stable')
+                self._index = (np.vstack(parts)[order], owners[order], streets)
+            return self._index
+
+    def frontage(self, ring: List[List[float]], slack: float=FRONTAGE_SLACK) -> Optional[List[Tuple[Street,float]]]:
+        """Finds the streets fronting a parcel ring and the length of frontage
+        along each, loading centerlines as needed. A street fronts the parcel
+        if a property line comes within half its right-of-way plus `slack` of
+        the centerline; property lines lying wholly within that reach count
+        towards the frontage of the nearest such street. Streets are returned
+        longest frontage first. Returns `None` if centerlines could not be
+        fetched.
+        """
+        coords = np.asarray(ring, dtype=np.float64).reshape(-1, 2)
+        reach_max = max(STREET_ROW.values())/2 + slack
+        xmin, ymin = coords.min(axis=0) - reach_max
+        xmax, ymax = coords.max(axis=0) + reach_max
+        if not self.load(Envelope(xmin, ymin, xmax, ymax)):
+            return None
+        segments, owners, streets = self.index()
+        near = (
+            (np.minimum(segments[:, 0], segments[:, 2]) <= xmax) & (np.maximum(segments[:, 0], segments[:, 2]) >= xmin)
+            & (np.minimum(segments[:, 1], segments[:, 3]) <= ymax) & (np.maximum(segments[:, 1], segments[:, 3]) >= ymin)
+        )
+        if not near.any():
+            return []
+        segments, owners = segments[near], owners[near]
+        edges = np.hstack((coords, np.roll(coords, -1, axis=0)))
+        lengths = np.hypot(edges[:, 2] - edges[:, 0], edges[:, 3] - edges[:, 1])
+        edges, lengths = edges[lengths > 0], lengths[lengths > 0]
+        # reduce segment columns to the nearest segment of each street
+        starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+        candidates = owners[starts]
+        reach = np.array([streets[n].row/2 + slack for n in candidates])
+        touching = np.minimum.reduceat(segment_distances(edges, segments), starts, axis=1) <= reach
+        ends = np.maximum(
+            np.minimum.reduceat(point_segment_distances(edges[:, :2], segments), starts, axis=1),
+            np.minimum.reduceat(point_segment_distances(edges[:, 2:], segments), starts, axis=1),
+        )
+        along = np.where(ends <= reach, ends, np.inf)
+        fronting = np.isfinite(along).any(axis=1)
+        nearest = along.argmin(axis=1)
+        totals = np.bincount(nearest[fronting], weights=lengths[fronting], minlength=len(candidates))
+        result = [(streets[n], float(total)) for n, total, touches in zip(candidates, totals, touching.any(axis=0)) if touches]
+        return sorted(result, key=lambda r: -r[1])
+
 def zoning(ring: List[float]) -> Optional[Zone]:
     """Queries multiple CLR Planning & Development zoning GIS servers to find
     which zoning criteria apply to a particular ring geometry. Returns a
@@ -407,32 +1050,21 @@ def zoning(ring: List[float]) -> Optional[Zone]:
     dod_params["outFields"] = "name,ordinance"
     zone_params = deepcopy(base_params)
     zone_params['outFields'] = "GIS_LR.GISPLAN.Zoning_Poly.ZONING"
-    s = requests.session()
-    actions_resp = s.get(actions_url,params=actions_params)
-    actions_data = server_ok(actions_resp, "Planning actions")
-    if not actions_data:
+    actions_resp = session.get(actions_url,params=actions_params)
+    actions = server_features(actions_resp, "Planning actions", ["GIS_LR.GISPLAN.Z_Number.LABEL"])
+    if actions is None:
         return None
-    features = actions_data.get("features",[])
-    cases = []
-    for f in features:
-        case = f.get("attributes",{}).get("GIS_LR.GISPLAN.Z_Number.LABEL")
-        cases.append(case)
-    cases = cases or None
-    dod_resp = s.get(dod_url,params=dod_params)
-    dod_data = server_ok(dod_resp, "Design overlay")
-    if not dod_data:
+    cases = actions.attributes["GIS_LR.GISPLAN.Z_Number.LABEL"] or None
+    dod_resp = session.get(dod_url,params=dod_params)
+    dod = server_features(dod_resp, "Design overlay", ["name"])
+    if dod is None:
         return None
-    features = dod_data.get("features",[])
-    overlays = []
-    for f in features:
-        overlay = f.get("attributes",{}).get("name")
-        overlays.append(overlay)
-    overlays = overlays or None
-    zone_resp = s.get(zone_url,params=zone_params)
-    zone_data = server_ok(zone_resp, "Zoning")
-    if not zone_data:
+    overlays = dod.attributes["name"] or None
+    zone_resp = session.get(zone_url,params=zone_params)
+    zones = server_features(zone_resp, "Zoning", ["GIS_LR.GISPLAN.Zoning_Poly.ZONING"])
+    if zones is None:
         return None
-    zone = zone_data.get("features",[{}])[0].get("attributes",{}).get("GIS_LR.GISPLAN.Zoning_Poly.ZONING")
+    zone = next(iter(zones.attributes["GIS_LR.GISPLAN.Zoning_Poly.ZONING"]), None)
     if not zone:
         log.warning(f"Zoning data unavailable\nquery:{zone_resp.url}")
         return None
@@ -455,17 +1087,13 @@ def floodmap(ring: List[List[float]]) -> Set[str]:
         "maxAllowableOffset":1,
         "outFields": "FLD_ZONE,LEGEND"
     }
-    resp = requests.get(url,params=params)
-    data = server_ok(resp, "Flood Hazard Map")
-    if not data:
+    resp = session.get(url,params=params)
+    features = server_features(resp, "Flood Hazard Map", ["FLD_ZONE","LEGEND"])
+    if features is None:
         return None
-    features = data.get("features",[])
     log.debug(f"query returned {len(features)} features")
     zones = set()
-    for feat in features:
-        f = feat.get("attributes",{})
-        zone = f.get("FLD_ZONE")
-        legend = f.get("LEGEND")
+    for zone, legend in zip(features.attributes["FLD_ZONE"], features.attributes["LEGEND"]):
         if zone is None or legend is None:
             continue
         zones.add(zone)
@@ -474,12 +1102,93 @@ def floodmap(ring: List[List[float]]) -> Set[str]:
     log.debug(f"Zones are: {zones}")
     return zones
 
+# Layers queried by the functions above, grouped by the result they feed.
+LAYERS = {
+    "parcel": [
+        "https://pagis.org/arcgis/rest/services/APPS/OperationalLayers/MapServer/51",
+    ],
+    "flood": [
+        "https://www.pagis.org/arcgis/rest/services/APPS/Apps_DFIRM/MapServer/20",
+    ],
+    "zoning": [
+        "https://maps.littlerock.state.ar.us/arcgis/rest/services/Zoning/MapServer/7",
+        "https://maps.littlerock.state.ar.us/arcgis/rest/services/Zoning/MapServer/13",
+        "https://maps.littlerock.state.ar.us/arcgis/rest/services/Zoning/MapServer/32",
+    ],
+    "streets": [
+        "https://maps.littlerock.state.ar.us/arcgis/rest/services/Master_Street_Plan/MapServer/0",
+    ],
+}
+
+def edit_dates() -> Dict[str,Optional[int]]:
+    """Returns the most recent edit date, in epoch milliseconds, of each group
+    of layers in `LAYERS`. A group's date is `None` if any of its layers does
+    not report one.
+    """
+    dates = {}
+    for group, urls in LAYERS.items():
+        latest = 0
+        for url in urls:
+            resp = session.get(url, params={"f": "json"})
+            data = server_ok(resp, f"{group} layer info")
+            date = (data or {}).get("editingInfo", {}).get("lastEditDate")
+            if date is None:
+                log.debug(f"no edit date for {url}")
+                latest = None
+                break
+            latest = max(latest, date)
+        dates[group] = latest
+    log.debug(f"layer edit dates: {dates}")
+    return dates
+
+
+def loads(content: bytes) -> Any:
+    """Decodes JSON from raw response bytes, with orjson if it is installed.
+    Decoding the bytes directly skips requests' text decoding.
+    """
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+def parse_features(content: bytes, fields: List[str], geometry: bool=False) -> Features:
+    """Extracts only `fields` (and optionally ring or path geometry) from an
+    ArcGIS query response. Features missing a field get `None` in its column.
+    Raises `ValueError` if the response is not a JSON object or is an ArcGIS
+    error, which is returned with a status of 200.
+    """
+    data = loads(content)
+    if not isinstance(data, dict):
+        raise ValueError("query response is not a JSON object")
+    if "error" in data:
+        raise ValueError(f"query returned error: {data['error']}")
+    attributes = {f: [] for f in fields}
+    columns = [attributes[f] for f in fields]
+    rings = [] if geometry else None
+    for feature in data.get("features") or ():
+        attrs = feature.get("attributes") or {}
+        for field, column in zip(fields, columns):
+            column.append(attrs.get(field))
+        if geometry:
+            geom = feature.get("geometry") or {}
+            rings.append([np.array(r, dtype=np.float64).reshape(-1, 2) for r in geom.get("rings") or geom.get("paths") or ()])
+    return Features(attributes, rings, bool(data.get("exceededTransferLimit")))
+
+def server_features(r: requests.Response, name: str, fields: List[str], geometry: bool=False) -> Optional[Features]:
+    """Like `server_ok`, but parses the response with `parse_features`."""
+    if r.status_code != 200:
+        log.warning(f"Failed to connect to {name} server.\nStatus:{r.status_code}\nQuery:{r.url}")
+        return None
+    try:
+        return parse_features(r.content, fields, geometry)
+    except ValueError as e:
+        log.warning(f"Invalid response from {name} server with error: {e}\nQuery:{r.url}")
+        return None
 
 def server_ok(r: requests.Response, name: str) -> Optional[Dict[Any,Any]]:
-    """Check for status code of 200 and return response.json() if successful.    
+    """Check for status code of 200 and return the decoded JSON if successful.
     Otherwise log a warning and return `None`
     """
     if r.status_code != 200:
         log.warning(f"Failed to connect to {name} server.\nStatus:{r.status_code}\nQuery:{r.url}")
         return None
-    return r.json()
\ No newline at end of file
+    return loads(r.content)
\ No newline at end of file
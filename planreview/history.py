@@ -0,0 +1,170 @@
+"""## history
+
+history keeps a record of every review so a resubmittal can be re-reviewed
+incrementally. A review is stored by location and project along with its GIS
+results, the edit date of every GIS layer used, the `Meta` flags and the
+comments issued.
+
+When plans come back, `rereview` compares the current layer edit dates and
+parcel geometry with the prior review and only queries the layers which may
+have changed. The base comments are only re-rendered if the GIS results or the
+`Meta` flags differ from last time. The new comment list is diffed against the
+prior letter:
+
+```
+python -m planreview rereview resubmittals.jsonl --history reviews.db
+```
+
+Resubmittals use the `batch` record format.
+"""
+
+import argparse
+import asyncio
+import difflib
+import json
+import logging
+import sqlite3
+import time
+from concurrent.futures import Executor
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional
+
+from . import esri
+from . import comment
+from . import batch
+
+log = logging.getLogger(__name__)
+
+LAYER_GROUPS = ["flood", "zoning", "streets"]
+
+@dataclass
+class Rereview:
+    comments: List[str]
+    diff: List[str]
+    requeried: List[str]
+    rendered: bool
+
+def review_key(record: batch.Record) -> str:
+    return f"{batch.location_key(record.location)}|{record.project.upper().strip()}"
+
+def diff(old: List[str], new: List[str]) -> List[str]:
+    """Compares two comment lists. Each comment is returned prefixed with `+ `
+    if it was added, `- ` if it was removed or two spaces if unchanged.
+    """
+    return [line for line in difflib.ndiff(old, new) if not line.startswith('? ')]
+
+class ReviewStore:
+    def __init__(self, path: str):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS reviews (id INTEGER PRIMARY KEY, key TEXT NOT NULL, created REAL NOT NULL, data TEXT NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS reviews_key ON reviews (key)")
+
+    def close(self) -> ():
+        self.db.close()
+
+    def latest(self, key: str) -> Optional[Dict[str,Any]]:
+        """Returns the most recent review stored under `key`."""
+        row = self.db.execute(
+            "SELECT data FROM reviews WHERE key = ? ORDER BY id DESC LIMIT 1", (key,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def add(self, key: str, review: Dict[str,Any]) -> ():
+        with self.db:
+            self.db.execute(
+                "INSERT INTO reviews (key, created, data) VALUES (?, ?, ?)",
+                (key, time.time(), json.dumps(review)),
+            )
+
+async def rereview(store: ReviewStore, record: batch.Record, dates: Dict[str,Optional[int]], pool: Optional[Executor]=None) -> Optional[Rereview]:
+    """Reviews `record`, reusing what it can from the prior review of the same
+    location and project. `dates` are the current layer edit dates from
+    `esri.edit_dates`, fetched once for a run of resubmittals. The review is
+    added to `store`. Returns `None` if the parcel cannot be found and raises
+    `LookupError` if a flood hazard or zoning query fails.
+    """
+    loop = asyncio.get_running_loop()
+    key = review_key(record)
+    prior = store.latest(key)
+    if prior is None:
+        stale = {"parcel", *LAYER_GROUPS}
+    else:
+        # layers which do not report an edit date are always treated as stale
+        stale = {g for g, date in dates.items() if date is None or date != prior["edit_dates"].get(g)}
+    if "parcel" in stale:
+        parcel = await asyncio.to_thread(batch.locate, record.location)
+        if parcel is None:
+            log.warning(f"No parcel found for {record.location}")
+            return None
+        if prior is None or batch.encode_parcel(parcel) != prior["parcel"]:
+            log.debug(f"parcel geometry for {record.location} is new or changed")
+            stale.update(LAYER_GROUPS)
+    else:
+        parcel = batch.decode_parcel(prior["parcel"])
+    layers = dict(prior["layers"]) if prior else {}
+    requeried = [g for g in LAYER_GROUPS if g in stale]
+    queries = {}
+    if "flood" in stale:
+        queries["flood"] = asyncio.to_thread(esri.floodmap, parcel.ring)
+    if "zoning" in stale:
+        queries["zoning"] = asyncio.to_thread(esri.zoning, parcel.ring)
+    if "streets" in stale:
+        queries["streets"] = asyncio.to_thread(esri.trans, batch.buffer(parcel.ring))
+    results = dict(zip(queries, await asyncio.gather(*queries.values())))
+    if "flood" in results:
+        if results["flood"] is None:
+            raise LookupError("flood hazard query failed")
+        layers["flood"] = sorted(results["flood"])
+    if "zoning" in results:
+        if results["zoning"] is None:
+            raise LookupError("zoning query failed")
+        layers["zone"] = asdict(results["zoning"])
+    if "streets" in results:
+        layers["streets"] = [asdict(s) for s in results["streets"] or []]
+    survey = batch.decode_survey(parcel, layers)
+    meta = asdict(record.meta)
+    unchanged = prior is not None and prior["meta"] == meta and prior["parcel"] == batch.encode_parcel(parcel) and prior["layers"] == layers
+    if unchanged:
+        base = prior["base"]
+    else:
+        base = await loop.run_in_executor(pool, comment.generate_base_comments, survey.master(record.meta))
+    comments = base + record.comments
+    store.add(key, {
+        "parcel": batch.encode_parcel(parcel),
+        "layers": layers,
+        "edit_dates": dates,
+        "meta": meta,
+        "base": base,
+        "comments": comments,
+    })
+    return Rereview(comments, diff(prior["comments"] if prior else [], comments), requeried, not unchanged)
+
+async def main(argv: List[str]) -> ():
+    parser = argparse.ArgumentParser(prog="planreview rereview")
+    parser.add_argument("records", help="JSON lines file of resubmittals")
+    parser.add_argument("--history", default="reviews.db", help="review history database")
+    parser.add_argument("--optimize", action="store_true", help="write optimised PDF letters")
+    args = parser.parse_args(argv)
+    records = batch.load_records(args.records)
+    store = ReviewStore(args.history)
+    try:
+        dates = await asyncio.to_thread(esri.edit_dates)
+        for record in records:
+            try:
+                result = await rereview(store, record, dates)
+                if result is None:
+                    print(f"failed: {record.location}")
+                    continue
+                await asyncio.to_thread(batch.write_letter, result.comments, record, args.optimize)
+            except Exception as e:
+                print(f"failed: {record.location}: {e}")
+                continue
+            print(f"{record.location} ({record.project}): wrote {record.dest}, re-queried {', '.join(result.requeried) or 'nothing'}")
+            for line in result.diff:
+                if not line.startswith('  '):
+                    print(f"    {line}")
+    finally:
+        store.close()
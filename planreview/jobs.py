@@ -0,0 +1,206 @@
+"""## jobs
+
+jobs is a durable queue for batch reviews. Each record is stored as a job in a
+SQLite database along with the last stage it completed and the result of that
+stage. A job moves through the stages:
+
+```
+queued -> geocoded -> parcel -> layers -> rendered -> written
+```
+
+Results are committed as each stage finishes, so a batch interrupted by a
+server outage or a bad record can be restarted and will only redo the work
+that did not finish. Failed jobs keep their last good stage and are retried on
+the next run until they have failed `max_attempts` times.
+
+```
+python -m planreview batch records.jsonl --store jobs.db
+```
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+from concurrent.futures import Executor
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional
+
+from . import esri
+from . import batch
+
+log = logging.getLogger(__name__)
+
+STAGES = ["queued", "geocoded", "parcel", "layers", "rendered", "written"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    key TEXT UNIQUE NOT NULL,
+    record TEXT NOT NULL,
+    stage TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated REAL
+);
+CREATE TABLE IF NOT EXISTS results (
+    job INTEGER NOT NULL REFERENCES jobs(id),
+    stage TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (job, stage)
+);
+"""
+
+@dataclass
+class Job:
+    id: int
+    record: batch.Record
+    stage: str
+    attempts: int = 0
+    error: Optional[str] = None
+
+    def done(self, stage: str) -> bool:
+        """Whether the job has already completed `stage`."""
+        return STAGES.index(self.stage) >= STAGES.index(stage)
+
+class JobStore:
+    def __init__(self, path: str):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def close(self) -> ():
+        self.db.close()
+
+    def add(self, records: List[batch.Record]) -> int:
+        """Queues records, ignoring any already in the store. Returns the
+        number of new jobs.
+        """
+        added = 0
+        with self.db:
+            for record in records:
+                data = json.dumps(asdict(record), sort_keys=True)
+                key = hashlib.sha1(data.encode()).hexdigest()
+                cur = self.db.execute(
+                    "INSERT OR IGNORE INTO jobs (key, record, updated) VALUES (?, ?, ?)",
+                    (key, data, time.time()),
+                )
+                added += cur.rowcount
+        return added
+
+    def pending(self, max_attempts: Optional[int]=None) -> List[Job]:
+        """Returns unfinished jobs which have not exhausted their attempts."""
+        rows = self.db.execute(
+            "SELECT id, record, stage, attempts, error FROM jobs WHERE stage != 'written' ORDER BY id"
+        ).fetchall()
+        jobs = []
+        for id, record, stage, attempts, error in rows:
+            if max_attempts is not None and attempts >= max_attempts:
+                continue
+            jobs.append(Job(id, batch.record_from_dict(json.loads(record)), stage, attempts, error))
+        return jobs
+
+    def checkpoint(self, job: Job, stage: str, result: Any) -> ():
+        """Records that `job` completed `stage` with `result`."""
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO results (job, stage, data) VALUES (?, ?, ?)",
+                (job.id, stage, json.dumps(result)),
+            )
+            self.db.execute(
+                "UPDATE jobs SET stage = ?, error = NULL, updated = ? WHERE id = ?",
+                (stage, time.time(), job.id),
+            )
+        job.stage = stage
+
+    def result(self, job: Job, stage: str) -> Any:
+        row = self.db.execute(
+            "SELECT data FROM results WHERE job = ? AND stage = ?", (job.id, stage)
+        ).fetchone()
+        if row is None:
+            raise LookupError(f"job {job.id} has no result for stage {stage}")
+        return json.loads(row[0])
+
+    def fail(self, job: Job, error: str) -> ():
+        with self.db:
+            self.db.execute(
+                "UPDATE jobs SET attempts = attempts + 1, error = ?, updated = ? WHERE id = ?",
+                (error, time.time(), job.id),
+            )
+        job.attempts += 1
+        job.error = error
+
+    def summary(self) -> Dict[str,int]:
+        """Counts jobs by stage, plus the number of unfinished jobs with errors."""
+        counts = {stage: 0 for stage in STAGES}
+        for stage, n in self.db.execute("SELECT stage, count(*) FROM jobs GROUP BY stage"):
+            counts[stage] = n
+        counts["failed"] = self.db.execute(
+            "SELECT count(*) FROM jobs WHERE error IS NOT NULL AND stage != 'written'"
+        ).fetchone()[0]
+        return counts
+
+async def process(store: JobStore, job: Job, pool: Executor, optimize: bool=False, index: Optional[esri.ParcelIndex]=None) -> ():
+    """Advances a job from its last completed stage through to a written
+    letter, checkpointing after each stage. Geocoded jobs are resolved from
+    parcels already in `index` where possible.
+    """
+    loop = asyncio.get_running_loop()
+    record = job.record
+    is_address = ' ' in record.location
+    if not job.done("geocoded"):
+        location = None
+        if is_address:
+            location = await asyncio.to_thread(esri.geocode, record.location)
+            if location is None:
+                raise LookupError(f"cannot geocode {record.location}")
+        store.checkpoint(job, "geocoded", location)
+    if not job.done("parcel"):
+        if is_address:
+            parcel = await asyncio.to_thread(esri.fetch_parcel_at, store.result(job, "geocoded"), index)
+        else:
+            parcel = await asyncio.to_thread(esri.fetch_parcel, esri.params_from_pid(record.location))
+        if parcel is None:
+            raise LookupError(f"no parcel found for {record.location}")
+        store.checkpoint(job, "parcel", batch.encode_parcel(parcel))
+    parcel = batch.decode_parcel(store.result(job, "parcel"))
+    if not job.done("layers"):
+        flood, zone, streets = await asyncio.gather(
+            asyncio.to_thread(esri.floodmap, parcel.ring),
+            asyncio.to_thread(esri.zoning, parcel.ring),
+            asyncio.to_thread(esri.trans, batch.buffer(parcel.ring)),
+        )
+        if flood is None:
+            raise LookupError("flood hazard query failed")
+        if zone is None:
+            raise LookupError("zoning query failed")
+        store.checkpoint(job, "layers", batch.encode_layers(flood, zone, streets or []))
+    if not job.done("rendered"):
+        survey = batch.decode_survey(parcel, store.result(job, "layers"))
+        comments = await loop.run_in_executor(pool, batch.render_comments, survey.master(record.meta), record)
+        store.checkpoint(job, "rendered", comments)
+    if not job.done("written"):
+        comments = store.result(job, "rendered")
+        dest = await loop.run_in_executor(pool, batch.write_letter, comments, record, optimize)
+        store.checkpoint(job, "written", dest)
+
+async def run(store: JobStore, workers: Optional[int]=None, concurrency: int=8, max_attempts: Optional[int]=3, optimize: bool=False) -> Dict[str,int]:
+    """Processes every pending job in the store and returns the store summary.
+    At most `concurrency` jobs are in flight at once.
+    """
+    jobs = store.pending(max_attempts)
+    log.info(f"{len(jobs)} jobs pending in {store.path}")
+    limit = asyncio.Semaphore(concurrency)
+    index = esri.ParcelIndex()
+    with batch.process_pool(workers) as pool:
+        async def bounded(job: Job) -> ():
+            async with limit:
+                try:
+                    await process(store, job, pool, optimize, index)
+                except Exception as e:
+                    log.warning(f"job {job.id} ({job.record.location}) failed after stage {job.stage} with error: {e}")
+                    store.fail(job, f"{type(e).__name__}: {e}")
+        await asyncio.gather(*(bounded(j) for j in jobs))
+    return store.summary()
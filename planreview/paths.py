@@ -0,0 +1,16 @@
+"""## paths
+
+paths locates the files planreview keeps between runs. They all live under one
+cache directory, `~/.cache/planreview`, or the directory in the
+`PLANREVIEW_CACHE` environment variable:
+
+- `surveys.db`: GIS results prefetched by `prefetch`
+- `images/`: letter images resampled by `pdf`
+"""
+
+import os
+
+def cache(*parts: str) -> str:
+    """Returns a path under the cache directory."""
+    root = os.environ.get("PLANREVIEW_CACHE") or os.path.join(os.path.expanduser("~"), ".cache", "planreview")
+    return os.path.join(root, *parts)
@@ -1,19 +1,46 @@
-"""Generates comment letters in PDF format."""
+"""Generates comment letters in PDF format.
+
+Letters may be generated in an optimised mode intended for bulk emailing and
+archival. Optimised letters embed the logo and signature resampled to print
+resolution, which is where nearly all of the size saving comes from, and have
+characters outside latin-1 replaced with ASCII equivalents so the core fonts
+can encode them. Resampling requires Pillow; without it the source images are
+embedded as-is.
+
+Resampled images are cached in the `images` directory of the planreview
+cache (see `paths`), which is only readable by the current user.
+"""
 
 import os
+import logging
+import stat
 from datetime import date
+from functools import lru_cache
 from typing import List, Dict
 from fpdf import FPDF
 
+from . import paths
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+log = logging.getLogger(__name__)
+
 HT = 5
 WD = 165
 MODPATH = os.path.dirname(os.path.abspath(__file__))
 LOGO = os.path.join(MODPATH,'resources','pw_logo.png')
 SIG = os.path.join(MODPATH,'resources','signature.png')
+LOGO_WD = 25
+SIG_WD = 40
+DPI = 150
+CACHE = paths.cache("images")
 
 class PDF(FPDF):
-    def letterhead(self):
-        self.image(LOGO,15,12.5,25)
+    def letterhead(self, logo: str=LOGO):
+        self.image(logo,15,12.5,LOGO_WD)
         self.set_font("times", "B", size=14)
         self.cell(37.5)
         self.cell(0, 12.5, txt="City of Little Rock", ln=1)
@@ -33,7 +60,7 @@ class PDF(FPDF):
         self.cell(50, 6)
         self.cell(75, 6, txt="www.littlerock.gov", align="R", ln=1)
    
-    def sign(self):
+    def sign(self, sig: str=SIG):
         signature = """Samuel Kreimeyer
 Civil Engineer I, CFM
 City of Little Rock Public Works
@@ -42,13 +69,65 @@ Little Rock, AR 72201
 (501) 918-5348
 """
         self.cell(0,HT,"Sincerely,",ln=1)
-        self.image(SIG,w=40)
+        self.image(sig,w=SIG_WD)
         self.multi_cell(w=0,h=HT,txt=signature)
 
+def owned(path: str) -> bool:
+    """Whether `path` is a regular file (not a link) owned by the current user,
+    so a cached image there can be trusted.
+    """
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISREG(st.st_mode) and (not hasattr(os, "getuid") or st.st_uid == os.getuid())
+
 def today() -> str:
     return date.today().strftime("%B %d, %Y")
 
-def generate(comments: List[str], app: Dict[str,str], project: str, approved:bool) -> FPDF:
+@lru_cache(maxsize=None)
+def downsampled(path: str, width: float, dpi: int=DPI) -> str:
+    """Returns the path of a copy of the image at `path` resampled to `dpi` when
+    printed `width` mm wide. Variants are cached on disk by source modification
+    time, so each is only resampled once; a cached file not owned by the
+    current user is replaced. The source path is returned if Pillow is
+    unavailable or the image is already at or below `dpi`.
+    """
+    if Image is None:
+        return path
+    pixels = round(width / 25.4 * dpi)
+    name, _ext = os.path.splitext(os.path.basename(path))
+    variant = os.path.join(CACHE, f"{name}_{pixels}w_{int(os.path.getmtime(path))}.png")
+    if owned(variant):
+        return variant
+    try:
+        with Image.open(path) as im:
+            if im.width <= pixels:
+                return path
+            height = round(im.height * pixels / im.width)
+            small = im.convert("RGB").resize((pixels, height), Image.LANCZOS)
+            os.makedirs(CACHE, mode=0o700, exist_ok=True)
+            tmp = f"{variant}.{os.getpid()}.tmp"
+            small.save(tmp, "PNG", optimize=True)
+            os.replace(tmp, variant)
+    except OSError as e:
+        log.warning(f"failed to resample {path} with error: {e}")
+        return path
+    log.debug(f"resampled {path} to {variant}")
+    return variant
+
+def core_text(text: str) -> str:
+    """Replaces characters outside of latin-1, which the core fonts cannot
+    encode, with their closest ASCII equivalents.
+    """
+    table = {
+        "\u2018": "'", "\u2019": "'", "\u201c": '"', "\u201d": '"',
+        "\u2013": "-", "\u2014": "-", "\u2026": "...", "\u2022": "*",
+    }
+    text = ''.join(table.get(c, c) for c in text)
+    return text.encode('latin-1', 'replace').decode('latin-1')
+
+def generate(comments: List[str], app: Dict[str,str], project: str, approved:bool, optimize: bool=False) -> FPDF:
     heading =f"""{date.today().strftime("%B %d, %Y")} via email
 
 {app['name']}
@@ -63,10 +142,16 @@ Dear {app['salutation']},
 """
     opening_remarks = f"The above referenced plans are {'not ' if not approved else ''}approved with the following comments and conditions:"
     end_remarks = "If you have any questions or desire additional information, place contact me by phone at (501) 918-5348 or by email at skreimeyer@littlerock.gov"
+    logo, sig = LOGO, SIG
     letter = PDF("P","mm","Letter")
+    if optimize:
+        logo = downsampled(LOGO, LOGO_WD)
+        sig = downsampled(SIG, SIG_WD)
+        heading = core_text(heading)
+        comments = [core_text(c) for c in comments]
     letter.add_page()
     letter.set_font('Arial','',12)
-    letter.letterhead()
+    letter.letterhead(logo)
     letter.set_left_margin(25)
     letter.set_right_margin(25)
     letter.set_x(25)
@@ -83,9 +168,15 @@ Dear {app['salutation']},
         letter.ln(h=270 - letter.get_y())
     letter.multi_cell(WD,HT, end_remarks)
     letter.ln()
-    letter.sign()
+    letter.sign(sig)
     return letter
 
 def save(letter: FPDF, destination: str) -> ():
     letter.output(destination,'F')
 
+
+def to_bytes(letter: FPDF) -> bytes:
+    data = letter.output(dest='S')
+    if isinstance(data, str): # pyfpdf returns the document as a latin-1 string
+        data = data.encode('latin-1')
+    return bytes(data)
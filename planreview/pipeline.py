@@ -0,0 +1,143 @@
+"""## pipeline
+
+pipeline runs items through a chain of async stages joined by bounded queues.
+Every stage has its own number of workers, so network waits in one stage, CPU
+work in the next and disk writes in the last all overlap across items. When a
+stage falls behind its input queue fills, and the stage feeding it blocks until
+there is room, so no stage runs more than a queue's length ahead of the next.
+
+Batch reviews run as three stages:
+
+```
+gis (esri queries) -> render (comment) -> write (pdf)
+```
+
+`Pipeline.stats` reports, for each stage, the depth of its input queue, how
+many items it is working on, how many it has finished or dropped, its
+throughput and how busy its workers have been.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+log = logging.getLogger(__name__)
+
+# Tells a worker that no more items are coming.
+DONE = object()
+
+class Stage:
+    """A step of a pipeline. `fn` is awaited for each item and its result is
+    passed to the next stage; a result of `None` (or an exception) drops the
+    item. `maxsize` bounds the stage's input queue, twice `workers` by default.
+    """
+    def __init__(self, name: str, fn: Callable[[Any], Awaitable[Any]], workers: int=1, maxsize: Optional[int]=None):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.maxsize = maxsize or 2*workers
+        self.queue: Optional[asyncio.Queue] = None
+        self.reset()
+
+    def reset(self) -> ():
+        self.busy = 0
+        self.done = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+
+    def stats(self, elapsed: float) -> Dict[str,Any]:
+        return {
+            "queued": self.queue.qsize() if self.queue else 0,
+            "busy": self.busy,
+            "workers": self.workers,
+            "done": self.done,
+            "failed": self.failed,
+            "per_second": self.done / elapsed if elapsed > 0 else 0.0,
+            "utilization": self.busy_seconds / (elapsed*self.workers) if elapsed > 0 else 0.0,
+        }
+
+class Pipeline:
+    def __init__(self, stages: List[Stage], describe: Callable[[Any], str]=str):
+        self.stages = stages
+        self.describe = describe
+        self.started = time.monotonic()
+
+    def stats(self) -> Dict[str,Dict[str,Any]]:
+        """Returns the current counters of every stage, by stage name."""
+        elapsed = time.monotonic() - self.started
+        return {stage.name: stage.stats(elapsed) for stage in self.stages}
+
+    async def run(self, items: Iterable[Any], report: Optional[Callable[[Dict[str,Dict[str,Any]]], Any]]=None, interval: float=5.0) -> List[Optional[Any]]:
+        """Runs every item through the stages. Results from the last stage are
+        returned in the same order as `items`, with `None` for dropped items.
+        If given, `report` is called with `stats` every `interval` seconds and
+        once more when the run finishes.
+        """
+        self.started = time.monotonic()
+        for stage in self.stages:
+            stage.reset()
+            stage.queue = asyncio.Queue(stage.maxsize)
+        inputs: Dict[int,Any] = {}
+        results: Dict[int,Any] = {}
+        count = 0
+
+        async def feed() -> ():
+            nonlocal count
+            first = self.stages[0]
+            for i, item in enumerate(items):
+                inputs[i] = item
+                count = i + 1
+                await first.queue.put((i, item))
+            for _ in range(first.workers):
+                await first.queue.put(DONE)
+
+        async def work(stage: Stage, following: Optional[Stage]) -> ():
+            while True:
+                entry = await stage.queue.get()
+                if entry is DONE:
+                    return
+                i, item = entry
+                stage.busy += 1
+                start = time.monotonic()
+                try:
+                    result = await stage.fn(item)
+                except Exception as e:
+                    log.warning(f"{stage.name} stage failed for {self.describe(inputs[i])} with error: {e}")
+                    result = None
+                finally:
+                    stage.busy -= 1
+                    stage.busy_seconds += time.monotonic() - start
+                if result is None:
+                    stage.failed += 1
+                    del inputs[i]
+                elif following is None:
+                    stage.done += 1
+                    results[i] = result
+                    del inputs[i]
+                else:
+                    stage.done += 1
+                    await following.queue.put((i, result))
+
+        async def run_stage(k: int) -> ():
+            stage = self.stages[k]
+            following = self.stages[k+1] if k + 1 < len(self.stages) else None
+            await asyncio.gather(*(work(stage, following) for _ in range(stage.workers)))
+            if following is not None:
+                for _ in range(following.workers):
+                    await following.queue.put(DONE)
+
+        async def monitor() -> ():
+            while True:
+                await asyncio.sleep(interval)
+                report(self.stats())
+
+        watcher = asyncio.ensure_future(monitor()) if report else None
+        try:
+            await asyncio.gather(feed(), *(run_stage(k) for k in range(len(self.stages))))
+        finally:
+            if watcher:
+                watcher.cancel()
+        if report:
+            report(self.stats())
+        return [results.get(i) for i in range(count)]
@@ -0,0 +1,114 @@
+"""## prefetch
+
+prefetch runs the GIS queries for a submittal ahead of its review and keeps
+the results in a local cache, so the reviewer does not wait on the servers.
+
+```
+python -m planreview prefetch "701 W MARKHAM" 34L0200708100
+python -m planreview prefetch -f upcoming.txt
+```
+
+The cache is a SQLite database, `surveys.db` in the planreview cache directory
+(see `paths`). Entries older than a week are treated as missing and fetched
+again.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from typing import Dict, List, Optional
+
+from . import batch
+from . import paths
+
+log = logging.getLogger(__name__)
+
+TTL = 7*24*60*60
+
+def default_path() -> str:
+    return paths.cache("surveys.db")
+
+class SurveyCache:
+    """GIS results for locations, stored on disk."""
+    def __init__(self, path: Optional[str]=None, ttl: float=TTL):
+        self.path = path or default_path()
+        self.ttl = ttl
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS surveys (key TEXT PRIMARY KEY, fetched REAL NOT NULL, data BLOB NOT NULL)"
+        )
+
+    def close(self) -> ():
+        self.db.close()
+
+    def get(self, location: str) -> Optional[batch.Survey]:
+        row = self.db.execute(
+            "SELECT fetched, data FROM surveys WHERE key = ?", (batch.location_key(location),)
+        ).fetchone()
+        if row is None or time.time() - row[0] > self.ttl:
+            return None
+        try:
+            return batch.Survey.from_bytes(row[1])
+        except ValueError as e: # written by another version or truncated
+            log.debug(f"discarding cached survey for {location}: {e}")
+            return None
+
+    def put(self, location: str, survey: batch.Survey) -> ():
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO surveys (key, fetched, data) VALUES (?, ?, ?)",
+                (batch.location_key(location), time.time(), survey.to_bytes()),
+            )
+
+async def survey(location: str, cache: SurveyCache, refresh: bool=False) -> Optional[batch.Survey]:
+    """Returns GIS results for a location from the cache, querying the servers
+    and caching the result on a miss. A failed GIS layer query raises
+    `batch.LayerError`, so nothing is cached for it.
+    """
+    if not refresh:
+        cached = cache.get(location)
+        if cached is not None:
+            log.debug(f"cache hit for {location}")
+            return cached
+    result = await batch.survey(location)
+    if result is not None:
+        cache.put(location, result)
+    return result
+
+async def prefetch(locations: List[str], cache: SurveyCache, concurrency: int=8, refresh: bool=False) -> Dict[str,bool]:
+    """Fetches GIS results for every location into `cache`. Returns whether
+    each location is now cached.
+    """
+    limit = asyncio.Semaphore(concurrency)
+    async def bounded(location: str) -> bool:
+        async with limit:
+            try:
+                return await survey(location, cache, refresh=refresh) is not None
+            except Exception as e:
+                log.warning(f"prefetch of {location} failed with error: {e}")
+                return False
+    results = await asyncio.gather(*(bounded(l) for l in locations))
+    return dict(zip(locations, results))
+
+async def main(argv: List[str]) -> ():
+    parser = argparse.ArgumentParser(prog="planreview prefetch")
+    parser.add_argument("locations", nargs="*", help="addresses or parcel IDs")
+    parser.add_argument("-f", "--file", help="file of locations, one per line")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="locations queried at once")
+    parser.add_argument("--cache", help=f"cache database (default: {default_path()})")
+    parser.add_argument("--refresh", action="store_true", help="query locations even if cached")
+    args = parser.parse_args(argv)
+    locations = list(args.locations)
+    if args.file:
+        with open(args.file) as f:
+            locations.extend(l.strip() for l in f if l.strip())
+    cache = SurveyCache(args.cache)
+    results = await prefetch(locations, cache, args.concurrency, args.refresh)
+    cache.close()
+    for location, ok in results.items():
+        print(f"{'cached' if ok else 'FAILED'}\t{location}")
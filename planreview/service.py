@@ -0,0 +1,262 @@
+"""## service
+
+service runs plan review as a long running HTTP service, so imports, GIS
+server connections, compiled templates and GIS results stay warm between
+reviews instead of being rebuilt by every `python -m planreview` process.
+
+```
+python -m planreview serve --port 8080 --workers 4
+```
+
+Endpoints:
+
+- `POST /review` takes a review request in the same JSON format as a `batch`
+  record (`dest` is ignored) and returns the comment list, the email body and
+  the PDF letter as base64. Set `"pdf": false` to skip the letter. It answers
+  404 if no parcel is found at the location and 503 if a GIS layer query
+  failed, in which case the request may be retried.
+- `GET /health` returns `{"status": "ok"}`.
+- `GET /metrics` returns request counts, cache statistics and timings.
+
+GIS results are cached per location in their compact binary encoding. At most
+`workers` reviews run at once and rendering is done in a pool of `workers`
+processes.
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import asdict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from . import esri
+from . import batch
+from . import comment
+from . import pdf
+
+log = logging.getLogger(__name__)
+
+MAX_BODY = 1 << 20
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+class LRUCache:
+    """A bounded cache which evicts the least recently used entry when full
+    and treats entries older than `ttl` seconds as missing.
+    """
+    def __init__(self, size: int=1024, ttl: float=24*60*60):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            self._data.pop(key, None)
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: Hashable, value: Any) -> ():
+        self._data[key] = (time.monotonic(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.size:
+            self._data.popitem(last=False)
+
+def render(master: comment.Master, record: batch.Record, letter: bool=True, optimize: bool=False) -> Tuple[List[str], str, Optional[bytes]]:
+    """Renders the comment list, email and (optionally) the PDF letter for a
+    review. Run in a worker process.
+    """
+    comments = comment.generate_base_comments(master) + record.comments
+    email = comment.generate_email(comments, record.applicant, record.approved)
+    if not letter:
+        return comments, email, None
+    doc = pdf.generate(comments, asdict(record.applicant), record.project, record.approved, optimize)
+    return comments, email, pdf.to_bytes(doc)
+
+class Service:
+    def __init__(self, workers: int=4, cache_size: int=1024, ttl: float=24*60*60, optimize: bool=False, frontage: bool=False):
+        self.workers = workers
+        self.optimize = optimize
+        self.network = esri.StreetNetwork(size=cache_size, ttl=ttl) if frontage else None
+        self.parcels = esri.ParcelIndex(cache_size, ttl)
+        self.pool = batch.process_pool(workers)
+        self.limit = asyncio.Semaphore(workers)
+        self.surveys = LRUCache(cache_size, ttl)
+        self.pending: Dict[str, asyncio.Future] = {}
+        self.started = time.monotonic()
+        self.metrics = {
+            "requests": 0,
+            "reviews": 0,
+            "errors": 0,
+            "in_flight": 0,
+            "review_seconds": 0.0,
+        }
+
+    async def survey(self, location: str) -> Optional[batch.Survey]:
+        """Returns GIS results for a location from the cache, joining any
+        request already in progress for the same location.
+        """
+        key = batch.location_key(location)
+        cached = self.surveys.get(key)
+        if cached is not None:
+            return batch.Survey.from_bytes(cached)
+        if key in self.pending:
+            return await asyncio.shield(self.pending[key])
+        task = asyncio.ensure_future(batch.survey(location, self.network, self.parcels))
+        self.pending[key] = task
+        try:
+            result = await asyncio.shield(task)
+        finally:
+            self.pending.pop(key, None)
+        if result is not None:
+            self.surveys.put(key, result.to_bytes())
+        return result
+
+    async def review(self, data: Dict[str,Any]) -> Tuple[int, Dict[str,Any]]:
+        try:
+            record = batch.record_from_dict(data)
+        except (KeyError, TypeError) as e:
+            return 400, {"error": f"invalid review request: {e}"}
+        async with self.limit:
+            self.metrics["in_flight"] += 1
+            start = time.monotonic()
+            try:
+                try:
+                    result = await self.survey(record.location)
+                except batch.LayerError as e:
+                    log.warning(f"review of {record.location} failed with error: {e}")
+                    return 503, {"error": str(e)}
+                if result is None:
+                    return 404, {"error": f"no parcel found for {record.location}"}
+                loop = asyncio.get_running_loop()
+                comments, email, letter = await loop.run_in_executor(
+                    self.pool, render, result.master(record.meta), record,
+                    data.get("pdf", True), data.get("optimize", self.optimize),
+                )
+            finally:
+                self.metrics["in_flight"] -= 1
+                self.metrics["review_seconds"] += time.monotonic() - start
+        self.metrics["reviews"] += 1
+        body = {"comments": comments, "email": email}
+        if letter is not None:
+            body["pdf"] = base64.b64encode(letter).decode('ascii')
+        return 200, body
+
+    def stats(self) -> Dict[str,Any]:
+        stats = dict(self.metrics)
+        stats["workers"] = self.workers
+        stats["uptime"] = time.monotonic() - self.started
+        stats["cache"] = {
+            "size": len(self.surveys),
+            "hits": self.surveys.hits,
+            "misses": self.surveys.misses,
+        }
+        return stats
+
+    async def route(self, method: str, path: str, body: bytes) -> Tuple[int, Dict[str,Any]]:
+        path = path.split('?')[0]
+        if path == "/health":
+            return (200, {"status": "ok"}) if method == "GET" else (405, {"error": "use GET"})
+        if path == "/metrics":
+            return (200, self.stats()) if method == "GET" else (405, {"error": "use GET"})
+        if path != "/review":
+            return 404, {"error": f"unknown path {path}"}
+        if method != "POST":
+            return 405, {"error": "use POST"}
+        try:
+            data = json.loads(body)
+        except ValueError as e:
+            return 400, {"error": f"invalid JSON: {e}"}
+        if not isinstance(data, dict):
+            return 400, {"error": "review request must be a JSON object"}
+        return await self.review(data)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> ():
+        """Serves HTTP/1.1 requests on a connection until the client closes it."""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                method, path, version = line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if not header.strip():
+                        break
+                    name, _, value = header.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                self.metrics["requests"] += 1
+                if length > MAX_BODY:
+                    status, payload = 413, {"error": f"body exceeds {MAX_BODY} bytes"}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length)
+                    try:
+                        status, payload = await self.route(method, path, body)
+                    except Exception as e:
+                        log.warning(f"{method} {path} failed with error: {e}")
+                        status, payload = 500, {"error": str(e)}
+                    keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                if status >= 400:
+                    self.metrics["errors"] += 1
+                content = json.dumps(payload).encode()
+                writer.write((
+                    f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(content)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+                ).encode('latin-1') + content)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError) as e:
+            log.debug(f"dropping connection with error: {e}")
+        finally:
+            writer.close()
+
+    async def start(self, host: str="127.0.0.1", port: int=8080) -> asyncio.AbstractServer:
+        server = await asyncio.start_server(self.handle, host, port)
+        log.info(f"serving on {host}:{port} with {self.workers} workers")
+        return server
+
+    def close(self) -> ():
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+async def main(argv: List[str]) -> ():
+    parser = argparse.ArgumentParser(prog="planreview serve")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=8080)
+    parser.add_argument("-w", "--workers", type=int, default=4, help="concurrent reviews and render processes")
+    parser.add_argument("--cache-size", type=int, default=1024, help="locations kept in the GIS cache")
+    parser.add_argument("--optimize", action="store_true", help="return optimised PDF letters by default")
+    parser.add_argument("--frontage", action="store_true", help="find streets by measured frontage instead of a buffer")
+    args = parser.parse_args(argv)
+    service = Service(args.workers, args.cache_size, optimize=args.optimize, frontage=args.frontage)
+    server = await service.start(args.host, args.port)
+    print(f"planreview serving on http://{args.host}:{args.port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
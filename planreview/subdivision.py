@@ -0,0 +1,94 @@
+"""## subdivision
+
+subdivision reviews a plat as a whole. Rather than looking up lots one at a
+time, every parcel intersecting the plat boundary is fetched in paged bulk
+queries and a single set of flood hazard, zoning and street queries is run
+against the boundary itself.
+
+```
+python -m planreview subdivision plat.json
+```
+
+`plat.json` is a `batch` record with either a `"boundary"` ring of x-y pairs
+or an `"envelope"` of `[xmin, ymin, xmax, ymax]`, in State Plane coordinates
+for Arkansas North. `location` is only used as a label. `Meta.subdivision` is
+always set.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+from dataclasses import dataclass
+from typing import List, Optional
+
+from . import esri
+from . import batch
+
+log = logging.getLogger(__name__)
+
+@dataclass
+class Plat:
+    boundary: List[List[float]]
+    lots: List[esri.ParcelData]
+    survey: batch.Survey
+
+def envelope_ring(envelope: esri.Envelope) -> List[List[float]]:
+    """Converts an envelope into a closed ring."""
+    e = envelope
+    return [[e.xmin, e.ymin], [e.xmin, e.ymax], [e.xmax, e.ymax], [e.xmax, e.ymin], [e.xmin, e.ymin]]
+
+async def survey(boundary: List[List[float]], contained: bool=True) -> Optional[Plat]:
+    """Fetches every lot within `boundary` and runs the GIS overlays once for
+    the whole plat. With `contained`, lots whose centroid falls outside the
+    boundary (neighbours which only touch it) are dropped. The plat survey's
+    parcel is the boundary itself, with the total acreage of its lots.
+    Lots without a recorded acreage are measured from their rings. Returns
+    `None` if the lots could not be fetched or a flood hazard or zoning query
+    failed.
+    """
+    lots = await asyncio.to_thread(esri.fetch_parcels, esri.params_from_ring(boundary))
+    if lots is None:
+        return None
+    if contained and lots:
+        inside = esri.points_in_ring(boundary, [[l.location['x'], l.location['y']] for l in lots])
+        lots = [l for l, keep in zip(lots, inside) if keep]
+    log.debug(f"plat contains {len(lots)} lots")
+    flood, zone, streets = await asyncio.gather(
+        asyncio.to_thread(esri.floodmap, boundary),
+        asyncio.to_thread(esri.zoning, boundary),
+        asyncio.to_thread(esri.trans, batch.buffer(boundary)),
+    )
+    if flood is None:
+        log.warning("Flood hazard query failed for plat")
+        return None
+    if zone is None:
+        log.warning("Zoning query failed for plat")
+        return None
+    measured = esri.ParcelCollection.from_parcels(lots).acres()
+    acres = float(sum(l.acres if l.acres is not None else m for l, m in zip(lots, measured)))
+    plat = esri.ParcelData(esri.centroid(boundary), boundary, acres, esri.make_envelope(boundary))
+    return Plat(boundary, lots, batch.Survey(plat, flood, zone, streets or []))
+
+async def main(argv: List[str]) -> ():
+    parser = argparse.ArgumentParser(prog="planreview subdivision")
+    parser.add_argument("plat", help="JSON batch record with a boundary or envelope")
+    parser.add_argument("--optimize", action="store_true", help="write an optimised PDF letter")
+    args = parser.parse_args(argv)
+    with open(args.plat) as f:
+        data = json.load(f)
+    if "boundary" in data:
+        boundary = data["boundary"]
+    elif "envelope" in data:
+        boundary = envelope_ring(esri.Envelope(*data["envelope"]))
+    else:
+        parser.error("the plat needs a boundary or an envelope")
+    record = batch.record_from_dict(data, f"{data.get('project') or 'subdivision'} comments.pdf")
+    record.meta.subdivision = True
+    plat = await survey(boundary)
+    if plat is None:
+        print(f"failed: could not survey the plat for {record.location}")
+        return
+    comments = batch.render_comments(plat.survey.master(record.meta), record)
+    batch.write_letter(comments, record, args.optimize)
+    print(f"{record.location}: {len(plat.lots)} lots, {plat.survey.parcel.acres:.2f} acres, wrote {record.dest}")
@@ -1,7 +1,8 @@
 import unittest
 import logging
+import contextlib
 
-from planreview import esri, comment
+from planreview import esri, comment, batch, service, jobs, prefetch, history, subdivision, pipeline
 
 # Set absolute file path for pytest
 import sys, os
@@ -10,6 +11,24 @@ myPath = os.path.dirname(os.path.abspath(__file__))
 # Add logging
 logging.basicConfig(level=logging.DEBUG)
 
+def sample_parcel():
+    """A 100 ft square parcel at the origin."""
+    ring = [[0.0,0.0],[0.0,100.0],[100.0,100.0],[100.0,0.0],[0.0,0.0]]
+    return esri.ParcelData(esri.centroid(ring),ring,0.6,esri.make_envelope(ring))
+
+@contextlib.contextmanager
+def mock_gis(parcel=None, flood=(), zone=None, streets=()):
+    """Patches the parcel lookup and the flood, zoning and street queries
+    with fixed results, by default an empty C3 `sample_parcel`. Yields the
+    mocks keyed by layer name.
+    """
+    from unittest import mock
+    with mock.patch.object(batch, "locate", return_value=parcel or sample_parcel()) as locate, \
+            mock.patch.object(esri, "floodmap", return_value=set(flood)) as floodmap, \
+            mock.patch.object(esri, "zoning", return_value=zone or esri.Zone("C3",None,None)) as zoning, \
+            mock.patch.object(esri, "trans", return_value=list(streets)) as trans:
+        yield {"parcel": locate, "flood": floodmap, "zoning": zoning, "streets": trans}
+
 class TestESRI(unittest.TestCase):
     def test_geocode(self):
         """We can find our own office"""
@@ -106,6 +125,195 @@ class TestESRI(unittest.TestCase):
         self.assertTrue(esri.is_outside(ring,outer_point))
         self.assertFalse(esri.is_outside(ring,inner_point))
 
+    def test_points_in_ring(self):
+        """Many points can be tested against a concave ring at once."""
+        ring = [[0.0,0.0],[10.0,0.0],[10.0,10.0],[5.0,3.0],[0.0,10.0],[0.0,0.0]]
+        points = [[5.0,5.0],[5.0,2.0],[2.0,5.0],[-1.0,1.0],[550.0,60.0]]
+        inside = esri.points_in_ring(ring, points)
+        self.assertEqual(inside.tolist(), [False, True, True, False, False])
+
+    def test_parse_features(self):
+        """Only requested fields and geometry are taken from a query response."""
+        from unittest import mock
+        content = b"""{"features": [
+            {"attributes": {"FLD_ZONE": "AE", "LEGEND": "Inside Floodway", "OTHER": 1},
+             "geometry": {"rings": [[[0.0, 0.0], [0.0, 1.0], [1.0, 1.0], [0.0, 0.0]]]}},
+            {"attributes": {"FLD_ZONE": "X"}}
+        ], "exceededTransferLimit": true}"""
+        for decoder in (esri.orjson, None):
+            with mock.patch.object(esri, "orjson", decoder):
+                features = esri.parse_features(content, ["FLD_ZONE", "LEGEND"], geometry=True)
+            self.assertEqual(features.attributes, {"FLD_ZONE": ["AE", "X"], "LEGEND": ["Inside Floodway", None]})
+            self.assertEqual(len(features), 2)
+            self.assertTrue(features.exceeded)
+            self.assertEqual(features.rings[0][0].shape, (4, 2))
+            self.assertEqual(features.rings[0][0].dtype, "float64")
+            self.assertEqual(features.rings[1], [])
+            with self.assertRaises(ValueError):
+                esri.parse_features(b'{"error": {"code": 400, "message": "Unable to complete operation."}}', ["FLD_ZONE"])
+        error = mock.Mock(status_code=200, content=b'{"error": {"code": 500}}', url="")
+        with mock.patch.object(esri.session, "get", return_value=error):
+            self.assertIsNone(esri.floodmap([[0.0,0.0],[0.0,1.0],[1.0,1.0],[0.0,0.0]]))
+
+    def test_parcel_collection(self):
+        """Geometry for many rings is computed at once and agrees with the
+        single ring functions.
+        """
+        import numpy as np
+        square = [[0.0,0.0],[0.0,1.0],[1.0,1.0],[1.0,0.0],[0.0,0.0]]
+        concave = [[0.0,0.0],[10.0,0.0],[10.0,10.0],[5.0,3.0],[0.0,10.0]]
+        triangle = [[20.0,0.0],[30.0,0.0],[20.0,10.0],[20.0,0.0]]
+        rings = [square, concave, triangle]
+        parcels = esri.ParcelCollection(rings)
+        self.assertEqual(len(parcels), 3)
+        for ring, envelope, center in zip(rings, parcels.envelopes(), parcels.centroids()):
+            e = esri.make_envelope(ring)
+            self.assertEqual(envelope.tolist(), [e.xmin, e.ymin, e.xmax, e.ymax])
+            self.assertTrue(np.allclose(center, list(esri.centroid(ring).values())))
+        self.assertTrue(np.allclose(parcels.areas(), [1.0, 65.0, 50.0]))
+        buffered = parcels.buffers(0.5)
+        self.assertEqual(buffered.rings()[0], [[-0.5,-0.5],[-0.5,1.5],[1.5,1.5],[1.5,-0.5],[-0.5,-0.5]])
+        # the 45 degree corners are mitered out to 0.5 from both edges
+        miter = 0.5*(1.0+np.sqrt(2))
+        self.assertTrue(np.allclose(buffered.envelopes()[2], [19.5,-0.5,30.0+miter,10.0+miter]))
+        self.assertTrue(np.allclose(parcels.buffers(0.5, limit=2.0).envelopes()[2], [19.5,-0.5,30.0+1/np.sqrt(2),10.0+1/np.sqrt(2)]))
+        # vertices along a straight edge move by the buffer distance alone
+        sides = [[0.0,0.0],[0.0,1.0],[0.0,2.0],[1.0,2.0],[2.0,2.0],[2.0,1.0],[2.0,0.0],[1.0,0.0],[0.0,0.0]]
+        self.assertEqual(esri.ParcelCollection([sides]).buffers(0.5).rings()[0], [
+            [-0.5,-0.5],[-0.5,1.0],[-0.5,2.5],[1.0,2.5],[2.5,2.5],[2.5,1.0],[2.5,-0.5],[1.0,-0.5],[-0.5,-0.5],
+        ])
+        theta = np.linspace(0.0, 2*np.pi, 361)
+        circle = np.stack((100.0*np.cos(theta), 100.0*np.sin(theta)), axis=1)
+        radii = np.hypot(*esri.ParcelCollection([circle]).buffers(100.0).coords.T)
+        self.assertTrue(np.allclose(radii, 200.0, rtol=1e-4))
+        points = [[0.5,0.5],[5.0,5.0],[5.0,2.0],[21.0,1.0],[29.0,9.0],[-1.0,-1.0]]
+        self.assertEqual(parcels.contains(points).tolist(), [0, -1, 1, 2, -1, -1])
+        self.assertEqual(parcels.contains(points, chunk=1).tolist(), [0, -1, 1, 2, -1, -1])
+
+    def test_segment_distances(self):
+        """Segment distances are found for every pair at once."""
+        import numpy as np
+        p = [[0.0,0.0,10.0,0.0],[0.0,5.0,0.0,15.0]]
+        q = [[5.0,-5.0,5.0,5.0],[20.0,3.0,30.0,3.0],[13.0,4.0,13.0,4.0]]
+        expected = [[0.0,np.hypot(10.0,3.0),5.0],[5.0,np.hypot(20.0,2.0),np.hypot(13.0,1.0)]]
+        self.assertTrue(np.allclose(esri.segment_distances(p, q), expected))
+
+    def test_frontage(self):
+        """Streets fronting a parcel are measured against cached centerlines."""
+        import json
+        from unittest import mock
+        def street(oid, name, scadd, path):
+            return {"attributes": {"OBJECTID": oid, "MapName": name, "AltDes": None, "SCADD_Type": scadd},
+                    "geometry": {"paths": [path]}}
+        page = {"features": [
+            street(1, "A ST", "Residential", [[-500.0,-25.0],[500.0,-25.0]]),
+            street(2, "B ST", "Collector", [[-30.0,-500.0],[-30.0,500.0]]),
+            street(3, "C ST", "Residential", [[-500.0,400.0],[500.0,400.0]]),
+        ]}
+        response = mock.Mock(status_code=200, content=json.dumps(page).encode(), url="")
+        network = esri.StreetNetwork(tile=5000.0)
+        corner = [[0.0,0.0],[0.0,150.0],[100.0,150.0],[100.0,0.0],[0.0,0.0]]
+        inside = [[200.0,0.0],[200.0,150.0],[300.0,150.0],[300.0,0.0],[200.0,0.0]]
+        with mock.patch.object(esri.session, "get", return_value=response) as get:
+            fronting = network.frontage(corner)
+            streets = esri.trans(inside, network)
+        self.assertEqual(get.call_count, 4)
+        self.assertEqual([(s.name, feet) for s, feet in fronting], [("B ST", 150.0), ("A ST", 100.0)])
+        self.assertEqual([s.name for s in streets], ["A ST"])
+
+    def test_network_loading(self):
+        """Failed tiles are fetched again, tiles being fetched are waited for
+        rather than fetched twice, and old tiles expire.
+        """
+        import json, threading, time
+        from unittest import mock
+        page = {"features": [{
+            "attributes": {"OBJECTID": 1, "MapName": "A ST", "AltDes": None, "SCADD_Type": "Residential"},
+            "geometry": {"paths": [[[-500.0,-25.0],[500.0,-25.0]]]},
+        }]}
+        good = mock.Mock(status_code=200, content=json.dumps(page).encode(), url="")
+        error = mock.Mock(status_code=200, content=b'{"error": {"code": 500}}', url="")
+        lot = [[0.0,0.0],[0.0,150.0],[100.0,150.0],[100.0,0.0],[0.0,0.0]]
+        network = esri.StreetNetwork(tile=5000.0, ttl=60.0)
+        with mock.patch.object(esri.session, "get", return_value=error):
+            self.assertIsNone(esri.trans(lot, network))
+        self.assertEqual(len(network.tiles), 0)
+        started = threading.Event()
+        def slow(*args, **kwargs):
+            started.set()
+            time.sleep(0.05)
+            return good
+        results = []
+        with mock.patch.object(esri.session, "get", side_effect=slow) as get:
+            first = threading.Thread(target=lambda: results.append(esri.trans(lot, network)))
+            first.start()
+            started.wait()
+            results.append(esri.trans(lot, network))
+            first.join()
+        self.assertEqual(get.call_count, 4)
+        self.assertEqual([[s.name for s in streets] for streets in results], [["A ST"], ["A ST"]])
+        clock = mock.Mock()
+        clock.monotonic.return_value = time.monotonic() + 61.0
+        with mock.patch.object(esri, "time", clock), \
+                mock.patch.object(esri.session, "get", return_value=good) as get:
+            self.assertEqual([s.name for s in esri.trans(lot, network)], ["A ST"])
+        self.assertEqual(get.call_count, 4)
+        bounded = esri.StreetNetwork(tile=100.0, size=2)
+        with mock.patch.object(esri.session, "get", return_value=good):
+            bounded.load(esri.Envelope(0.0, 0.0, 250.0, 50.0))
+        self.assertEqual(list(bounded.tiles), [(1, 0), (2, 0)])
+        self.assertEqual(len(bounded.features), 1)
+
+    def test_network_threads(self):
+        """The segment index never misses features added from other threads."""
+        import threading
+        import numpy as np
+        network = esri.StreetNetwork()
+        def add(t):
+            for i in range(200):
+                path = np.array([[float(i), float(t)], [float(i), float(t) + 1.0]])
+                network.add((t, i), esri.make_street(f"{t} {i} ST", None, "Residential"), [path])
+                network.index()
+        threads = [threading.Thread(target=add, args=(t,)) for t in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        segments, owners, streets = network.index()
+        self.assertEqual((len(segments), len(streets)), (800, 800))
+
+    def test_parcel_index(self):
+        """Points inside parcels already fetched are resolved without a query."""
+        from unittest import mock
+        def parcel(ring):
+            return esri.ParcelData(esri.centroid(ring), ring, 0.5, esri.make_envelope(ring))
+        lot = parcel([[0.0,0.0],[0.0,100.0],[100.0,100.0],[100.0,0.0],[0.0,0.0]])
+        triangle = parcel([[200.0,0.0],[200.0,100.0],[300.0,0.0],[200.0,0.0]])
+        index = esri.ParcelIndex()
+        with mock.patch.object(esri, "fetch_parcel", side_effect=[lot, triangle]) as fetch:
+            self.assertIs(esri.fetch_parcel_at({'x': 50.0, 'y': 50.0}, index), lot)
+            self.assertIs(esri.fetch_parcel_at({'x': 10.0, 'y': 90.0}, index), lot)
+            self.assertEqual(fetch.call_count, 1)
+            index.add(triangle)
+            index.add(lot)
+            self.assertEqual(len(index), 2)
+            self.assertIs(esri.fetch_parcel_at({'x': 210.0, 'y': 10.0}, index), triangle)
+            # inside the triangle's envelope but outside its ring
+            self.assertIsNone(index.find({'x': 290.0, 'y': 90.0}))
+            self.assertEqual(fetch.call_count, 1)
+        clock = mock.Mock()
+        clock.monotonic.return_value = 0.0
+        with mock.patch.object(esri, "time", clock):
+            bounded = esri.ParcelIndex(size=1, ttl=60.0)
+            bounded.add(lot)
+            bounded.add(triangle)
+            self.assertEqual(len(bounded), 1)
+            self.assertIsNone(bounded.find({'x': 50.0, 'y': 50.0}))
+            self.assertIs(bounded.find({'x': 210.0, 'y': 10.0}), triangle)
+            clock.monotonic.return_value = 61.0
+            self.assertIsNone(bounded.find({'x': 210.0, 'y': 10.0}))
+            self.assertEqual(len(bounded), 0)
+
     def test_trans_null(self):
         """Transportation layer does not return information for minor streets.
         """
@@ -236,6 +444,513 @@ class TestComment(unittest.TestCase):
         comment.generate_letter(comments,applicant,"Sausage Theme Park",destination,approved)
         self.assertTrue(True)
 
+    def test_pdf_optimized(self):
+        """Optimised comment letters are smaller and tolerate non latin-1 text."""
+        import tempfile
+        comments = [
+            "Don\u2019t forget the \u201cmustard\u201d \u2014 ever.",
+            "ABCDEFGHIJKLMNOPQRSTUVWXYZ"*10
+        ]
+        applicant = comment.Applicant(
+            "Abe Frohman, P.E.",
+            "Sausage King of Chicago",
+            "Mr. Frohman, sir",
+            "Sausage Works Inc.",
+            "123 Meat Lane",
+            "Chicago, IL 12345"
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            plain = os.path.join(tmp, "plain.pdf")
+            small = os.path.join(tmp, "small.pdf")
+            comment.generate_letter(comments[1:],applicant,"Sausage Theme Park",plain)
+            comment.generate_letter(comments,applicant,"Sausage Theme Park",small,optimize=True)
+            self.assertLessEqual(os.path.getsize(small),os.path.getsize(plain))
+
+    def test_downsampled_cache(self):
+        """Resampled images are not taken from a link planted in the cache."""
+        import tempfile
+        from unittest import mock
+        from planreview import pdf
+        if pdf.Image is None:
+            self.skipTest("Pillow is not installed")
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch.object(pdf, "CACHE", os.path.join(tmp, "images")):
+            pdf.downsampled.cache_clear()
+            expected = pdf.downsampled(pdf.LOGO, pdf.LOGO_WD)
+            os.remove(expected)
+            os.symlink(pdf.SIG, expected)
+            pdf.downsampled.cache_clear()
+            variant = pdf.downsampled(pdf.LOGO, pdf.LOGO_WD)
+            self.assertEqual(variant, expected)
+            self.assertFalse(os.path.islink(variant))
+            self.assertEqual(os.stat(os.path.join(tmp, "images")).st_mode & 0o777, 0o700)
+            pdf.downsampled.cache_clear()
+
+
+class TestCodec(unittest.TestCase):
+    def sample_master(self, vertices=1000):
+        import math
+        ring = [
+            [1228858.5 + 100*math.cos(2*math.pi*i/vertices), 151373.7 + 100*math.sin(2*math.pi*i/vertices)]
+            for i in range(vertices)
+        ]
+        ring.append(ring[0])
+        parcel = esri.ParcelData(esri.centroid(ring),ring,0.858314,esri.make_envelope(ring))
+        streets = [
+            esri.Street("W MARKHAM ST","commercial",60,True,False),
+            esri.Street("BROADWAY ST","principal arterial",110,False,True),
+        ]
+        zone = esri.Zone("R4A",["MacArthur Park Historic District"],["Z-6734-B",None])
+        meta = comment.Meta(True,False,True,False,True)
+        return comment.Master(meta, parcel, streets, {"AE","Floodway"}, zone)
+
+    def test_round_trip(self):
+        """Every type survives its binary encoding unchanged."""
+        m = self.sample_master()
+        self.assertEqual(esri.Envelope.from_bytes(m.parcel.envelope.to_bytes()), m.parcel.envelope)
+        self.assertEqual(esri.ParcelData.from_bytes(m.parcel.to_bytes()), m.parcel)
+        self.assertEqual(esri.Street.from_bytes(m.streets[0].to_bytes()), m.streets[0])
+        self.assertEqual(esri.Zone.from_bytes(m.zone.to_bytes()), m.zone)
+        self.assertEqual(esri.Zone.from_bytes(esri.Zone("M1",None,None).to_bytes()), esri.Zone("M1",None,None))
+        self.assertEqual(comment.Master.from_bytes(m.to_bytes()), m)
+        survey = batch.Survey(m.parcel, m.flood, None, [])
+        self.assertEqual(batch.Survey.from_bytes(survey.to_bytes()), survey)
+
+    def test_compact(self):
+        """Parcels pickle through the compact encoding."""
+        import pickle
+        m = self.sample_master()
+        self.assertEqual(pickle.loads(pickle.dumps(m)), m)
+        self.assertLess(len(pickle.dumps(m.parcel)), 17*len(m.parcel.ring) + 200)
+
+    def test_version(self):
+        """Data from another encoding version or of another type is rejected."""
+        data = bytearray(esri.Envelope(0.0,0.0,1.0,1.0).to_bytes())
+        with self.assertRaises(ValueError):
+            esri.Street.from_bytes(bytes(data))
+        data[0] += 1
+        with self.assertRaises(ValueError):
+            esri.Envelope.from_bytes(bytes(data))
+
+    def test_truncated(self):
+        """Every truncation of an encoding is rejected."""
+        data = self.sample_master(10).to_bytes()
+        for n in range(len(data)):
+            with self.assertRaises(ValueError):
+                comment.Master.from_bytes(data[:n])
+
+
+class TestBatch(unittest.TestCase):
+    def sample_record(self, dest):
+        applicant = comment.Applicant("A","B","C","D","E","F")
+        return batch.Record("34L0200708100","Test Project",applicant,comment.Meta(),dest=dest)
+
+    def test_load_records(self):
+        """Batch records are read from JSON lines."""
+        import json, tempfile
+        line = {
+            "location": "701 W MARKHAM",
+            "project": "City Hall",
+            "applicant": {
+                "name": "A", "title": "B", "salutation": "C",
+                "company": "D", "address": "E", "city_state_zip": "F",
+            },
+            "meta": {"grading": False},
+        }
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "records.jsonl")
+            with open(path, "w") as f:
+                f.write(json.dumps(line) + "\n\n" + json.dumps(line) + "\n")
+            records = batch.load_records(path)
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[0].applicant.salutation, "C")
+        self.assertFalse(records[0].meta.grading)
+        self.assertEqual(records[0].dest, "1 City Hall comments.pdf")
+        self.assertEqual(records[1].dest, "3 City Hall comments.pdf")
+
+    def test_run(self):
+        """A batch renders letters in worker processes."""
+        import asyncio, tempfile
+        with tempfile.TemporaryDirectory() as tmp, mock_gis():
+            records = [self.sample_record(os.path.join(tmp, f"{i}.pdf")) for i in range(3)]
+            results = asyncio.run(batch.run(records, workers=2))
+            self.assertEqual(results, [r.dest for r in records])
+            for dest in results:
+                self.assertTrue(os.path.exists(dest))
+
+    def test_survey_outage(self):
+        """A failed flood, zoning or street query fails the survey."""
+        import asyncio
+        for layer in ("flood", "zoning", "streets"):
+            with mock_gis() as gis:
+                gis[layer].return_value = None
+                with self.assertRaises(batch.LayerError):
+                    asyncio.run(batch.survey("701 W MARKHAM"))
+
+
+class TestPipeline(unittest.TestCase):
+    def test_backpressure(self):
+        """Stages overlap, keep order, drop failures and are held back by a
+        slow stage.
+        """
+        import asyncio
+        ahead = []
+        async def fetch(n):
+            await asyncio.sleep(0)
+            if n == 3:
+                raise LookupError("no parcel")
+            return None if n == 5 else n
+        async def render(n):
+            ahead.append(stages.stages[0].done - stages.stages[1].done)
+            await asyncio.sleep(0.001)
+            return n * 10
+        stages = pipeline.Pipeline([
+            pipeline.Stage("gis", fetch, workers=4, maxsize=2),
+            pipeline.Stage("render", render, workers=1, maxsize=2),
+        ])
+        reports = []
+        results = asyncio.run(stages.run(range(20), report=reports.append, interval=0.005))
+        self.assertEqual(results, [None if n in (3, 5) else n * 10 for n in range(20)])
+        # the render queue and gis workers bound how far gis can get ahead
+        self.assertLessEqual(max(ahead), 2 + 4 + 1)
+        final = reports[-1]
+        self.assertEqual((final["gis"]["done"], final["gis"]["failed"]), (18, 2))
+        self.assertEqual((final["render"]["done"], final["render"]["queued"]), (18, 0))
+        self.assertGreater(final["render"]["per_second"], 0.0)
+        self.assertGreater(len(reports), 1)
+
+
+class TestJobs(unittest.TestCase):
+    def test_resume(self):
+        """A failed job resumes from its last completed stage."""
+        import asyncio, tempfile
+        from unittest import mock
+        applicant = comment.Applicant("A","B","C","D","E","F")
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock_gis(streets=[esri.Street("W MARKHAM ST","commercial",60)]) as gis, \
+                mock.patch.object(esri, "fetch_parcel", return_value=sample_parcel()) as fetch:
+            records = [
+                batch.Record(f"PID{i}","Test Project",applicant,comment.Meta(),dest=os.path.join(tmp, f"{i}.pdf"))
+                for i in range(2)
+            ]
+            store = jobs.JobStore(os.path.join(tmp, "jobs.db"))
+            self.assertEqual(store.add(records), 2)
+            self.assertEqual(store.add(records), 0)
+            gis["flood"].return_value = None
+            summary = asyncio.run(jobs.run(store, workers=1))
+            self.assertEqual(summary["parcel"], 2)
+            self.assertEqual(summary["failed"], 2)
+            gis["flood"].return_value = {"AE"}
+            summary = asyncio.run(jobs.run(store, workers=1))
+            self.assertEqual(summary["written"], 2)
+            self.assertEqual(summary["failed"], 0)
+            self.assertEqual(fetch.call_count, 2)
+            for record in records:
+                self.assertTrue(os.path.exists(record.dest))
+            job = jobs.Job(1, records[0], "written")
+            self.assertTrue(any("W Markham St" in c for c in store.result(job, "rendered")))
+            store.close()
+
+    def test_resume_outage(self):
+        """A zoning outage is not checkpointed, so the job resumes once the
+        server is back.
+        """
+        import asyncio, tempfile
+        from unittest import mock
+        applicant = comment.Applicant("A","B","C","D","E","F")
+        with tempfile.TemporaryDirectory() as tmp, mock_gis() as gis, \
+                mock.patch.object(esri, "fetch_parcel", return_value=sample_parcel()):
+            record = batch.Record("PID1","Test Project",applicant,comment.Meta(),dest=os.path.join(tmp, "1.pdf"))
+            store = jobs.JobStore(os.path.join(tmp, "jobs.db"))
+            store.add([record])
+            gis["zoning"].return_value = None
+            summary = asyncio.run(jobs.run(store, workers=1))
+            self.assertEqual((summary["parcel"], summary["failed"]), (1, 1))
+            gis["zoning"].return_value = esri.Zone("C3",None,None)
+            summary = asyncio.run(jobs.run(store, workers=1))
+            self.assertEqual((summary["written"], summary["failed"]), (1, 0))
+            self.assertTrue(os.path.exists(record.dest))
+            store.close()
+
+
+class TestPrefetch(unittest.TestCase):
+    def test_prefetch(self):
+        """Prefetched GIS results are served from the local cache."""
+        import asyncio, tempfile
+        parcel = sample_parcel()
+        zone = esri.Zone("R2",["Overlay"],["Z-1"])
+        streets = [esri.Street("W MARKHAM ST","commercial",60,True,False)]
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock_gis(parcel, {"AE"}, zone, streets) as gis:
+            cache = prefetch.SurveyCache(os.path.join(tmp, "surveys.db"))
+            results = asyncio.run(prefetch.prefetch(["701 W MARKHAM", "PID1"], cache))
+            self.assertEqual(results, {"701 W MARKHAM": True, "PID1": True})
+            cached = asyncio.run(prefetch.survey("701  w markham", cache))
+            self.assertEqual(gis["parcel"].call_count, 2)
+            cache.close()
+        self.assertEqual(cached, batch.Survey(parcel, {"AE"}, zone, streets))
+
+    def test_outage(self):
+        """Surveys from a failed flood or zoning query are not cached."""
+        import asyncio, tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = prefetch.SurveyCache(os.path.join(tmp, "surveys.db"))
+            for layer in ("flood", "zoning"):
+                with mock_gis() as gis:
+                    gis[layer].return_value = None
+                    results = asyncio.run(prefetch.prefetch(["701 W MARKHAM"], cache))
+                self.assertEqual(results, {"701 W MARKHAM": False})
+                self.assertIsNone(cache.get("701 W MARKHAM"))
+            cache.close()
+
+    def test_cache_root(self):
+        """Prefetched surveys and resampled images share one cache directory."""
+        from unittest import mock
+        from planreview import paths
+        with mock.patch.dict(os.environ, {"PLANREVIEW_CACHE": "/srv/planreview"}):
+            self.assertEqual(prefetch.default_path(), os.path.join("/srv/planreview", "surveys.db"))
+            self.assertEqual(paths.cache("images"), os.path.join("/srv/planreview", "images"))
+
+    def test_corrupt(self):
+        """Truncated cache entries are treated as missing."""
+        import tempfile
+        data = batch.Survey(sample_parcel(), {"AE"}, esri.Zone("R2",None,None), []).to_bytes()
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = prefetch.SurveyCache(os.path.join(tmp, "surveys.db"))
+            for blob in (data[:1], data[:len(data)//2]):
+                with cache.db:
+                    cache.db.execute("INSERT OR REPLACE INTO surveys VALUES (?, ?, ?)", (batch.location_key("PID1"), 1e12, blob))
+                self.assertIsNone(cache.get("PID1"))
+            cache.close()
+
+
+class TestHistory(unittest.TestCase):
+    def test_rereview(self):
+        """Resubmittals only re-query changed layers and report comment changes."""
+        import asyncio, tempfile
+        applicant = comment.Applicant("A","B","C","D","E","F")
+        first = batch.Record("PID1","Test Project",applicant,comment.Meta(franchise=False))
+        second = batch.Record("PID1","Test Project",applicant,comment.Meta(franchise=True),comments=["special"])
+        dates = {"parcel": 1, "flood": 1, "zoning": 1, "streets": 1}
+        with tempfile.TemporaryDirectory() as tmp, mock_gis() as gis:
+            store = history.ReviewStore(os.path.join(tmp, "reviews.db"))
+            initial = asyncio.run(history.rereview(store, first, dates))
+            repeat = asyncio.run(history.rereview(store, first, dates))
+            changed = asyncio.run(history.rereview(store, second, dict(dates, flood=2)))
+            store.close()
+            self.assertEqual(gis["parcel"].call_count, 1)
+            self.assertEqual(gis["flood"].call_count, 2)
+        self.assertEqual(initial.requeried, ["flood", "zoning", "streets"])
+        self.assertTrue(all(line.startswith("+ ") for line in initial.diff))
+        self.assertEqual(repeat.requeried, [])
+        self.assertFalse(repeat.rendered)
+        self.assertTrue(all(line.startswith("  ") for line in repeat.diff))
+        self.assertEqual(changed.requeried, ["flood"])
+        self.assertTrue(changed.rendered)
+        added = [line for line in changed.diff if line.startswith("+ ")]
+        self.assertEqual(len(added), 2)
+        self.assertEqual(added[-1], "+ special")
+
+    def test_main(self):
+        """A failed resubmittal is reported without stopping the run, and edit
+        dates are fetched once.
+        """
+        import asyncio, io, json, tempfile
+        from contextlib import redirect_stdout
+        from unittest import mock
+        applicant = {"name": "A", "title": "B", "salutation": "C", "company": "D", "address": "E", "city_state_zip": "F"}
+        dates = {"parcel": 1, "flood": 1, "zoning": 1, "streets": 1}
+        with tempfile.TemporaryDirectory() as tmp, mock_gis() as gis, \
+                mock.patch.object(esri, "edit_dates", return_value=dates) as edit_dates:
+            gis["flood"].side_effect = [None, set()]
+            path = os.path.join(tmp, "resubmittals.jsonl")
+            with open(path, "w") as f:
+                for project in ("First", "Second"):
+                    f.write(json.dumps({
+                        "location": "PID1", "project": project, "applicant": applicant,
+                        "dest": os.path.join(tmp, f"{project}.pdf"),
+                    }) + "\n")
+            out = io.StringIO()
+            with redirect_stdout(out):
+                asyncio.run(history.main([path, "--history", os.path.join(tmp, "reviews.db")]))
+            self.assertEqual(edit_dates.call_count, 1)
+            self.assertTrue(os.path.exists(os.path.join(tmp, "Second.pdf")))
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], "failed: PID1: flood hazard query failed")
+        self.assertTrue(lines[1].startswith("PID1 (Second): wrote"))
+
+
+class TestSubdivision(unittest.TestCase):
+    def lot(self, x, y, size=100.0):
+        return [[x,y],[x,y+size],[x+size,y+size],[x+size,y],[x,y]]
+
+    def test_fetch_parcels(self):
+        """Parcels are fetched in pages and measured in one pass."""
+        import json
+        from unittest import mock
+        pages = [
+            {"features": [
+                {"attributes": {"CALC_ACRE": 0.25}, "geometry": {"rings": [self.lot(0.0,0.0)]}},
+                {"attributes": {"CALC_ACRE": 0.5}, "geometry": {"rings": [self.lot(100.0,0.0,200.0)]}},
+            ], "exceededTransferLimit": True},
+            {"features": [
+                {"attributes": {"CALC_ACRE": 0.25}, "geometry": {"rings": [self.lot(0.0,100.0)]}},
+            ]},
+        ]
+        responses = [mock.Mock(status_code=200, content=json.dumps(p).encode(), url="") for p in pages]
+        params = esri.params_from_ring(self.lot(0.0,0.0,300.0), page_size=2)
+        with mock.patch.object(esri.session, "get", side_effect=responses) as get:
+            parcels = esri.fetch_parcels(params)
+        self.assertEqual(get.call_args_list[1].kwargs["params"]["resultOffset"], 2)
+        self.assertEqual(len(parcels), 3)
+        for parcel in parcels:
+            self.assertEqual(parcel.envelope, esri.make_envelope(parcel.ring))
+            self.assertAlmostEqual(parcel.location['x'], esri.centroid(parcel.ring)['x'])
+            self.assertAlmostEqual(parcel.location['y'], esri.centroid(parcel.ring)['y'])
+
+    def test_survey(self):
+        """A plat is surveyed with one set of overlay queries."""
+        import asyncio
+        from unittest import mock
+        lots = [
+            esri.ParcelData(esri.centroid(r),r,0.5,esri.make_envelope(r))
+            for r in (self.lot(10.0,10.0), self.lot(120.0,10.0), self.lot(500.0,10.0))
+        ]
+        boundary = subdivision.envelope_ring(esri.Envelope(0.0,0.0,300.0,300.0))
+        with mock_gis(zone=esri.Zone("R2",None,None)) as gis, \
+                mock.patch.object(esri, "fetch_parcels", return_value=lots):
+            plat = asyncio.run(subdivision.survey(boundary))
+            self.assertEqual(gis["flood"].call_count, 1)
+            gis["flood"].return_value = None
+            self.assertIsNone(asyncio.run(subdivision.survey(boundary)))
+        self.assertEqual(len(plat.lots), 2)
+        self.assertEqual(plat.survey.parcel.acres, 1.0)
+        self.assertEqual(plat.survey.parcel.envelope, esri.Envelope(0.0,0.0,300.0,300.0))
+
+
+class TestService(unittest.TestCase):
+    def request(self, port, method, path, body=None):
+        import asyncio, json
+        async def go():
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            data = json.dumps(body).encode() if body is not None else b""
+            writer.write(
+                f"{method} {path} HTTP/1.1\r\nContent-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode() + data
+            )
+            response = await reader.read()
+            writer.close()
+            head, _, payload = response.partition(b"\r\n\r\n")
+            return int(head.split()[1]), json.loads(payload)
+        return go()
+
+    def test_review(self):
+        """The service reviews requests and caches GIS results between them."""
+        import asyncio, base64
+        request = {
+            "location": "34L0200708100",
+            "project": "Test Project",
+            "applicant": {
+                "name": "A", "title": "B", "salutation": "C",
+                "company": "D", "address": "E", "city_state_zip": "F",
+            },
+            "comments": ["special comment"],
+        }
+        async def scenario():
+            svc = service.Service(workers=1)
+            server = await svc.start(port=0)
+            port = server.sockets[0].getsockname()[1]
+            try:
+                health = await self.request(port, "GET", "/health")
+                first = await self.request(port, "POST", "/review", request)
+                second = await self.request(port, "POST", "/review", dict(request, pdf=False))
+                bad = await self.request(port, "POST", "/review", {"project": "x"})
+                metrics = await self.request(port, "GET", "/metrics")
+            finally:
+                server.close()
+                svc.close()
+            return health, first, second, bad, metrics
+        with mock_gis() as gis:
+            health, first, second, bad, metrics = asyncio.run(scenario())
+            self.assertEqual(gis["parcel"].call_count, 1)
+        self.assertEqual(health, (200, {"status": "ok"}))
+        status, body = first
+        self.assertEqual(status, 200)
+        self.assertEqual(body["comments"][-1], "special comment")
+        self.assertIn("Dear C", body["email"])
+        self.assertTrue(base64.b64decode(body["pdf"]).startswith(b"%PDF"))
+        self.assertEqual(second[0], 200)
+        self.assertNotIn("pdf", second[1])
+        self.assertEqual(bad[0], 400)
+        status, stats = metrics
+        self.assertEqual(stats["reviews"], 2)
+        self.assertEqual(stats["cache"]["hits"], 1)
+
+
+    def test_outage(self):
+        """A GIS outage is answered with 503 and a missing parcel with 404."""
+        import asyncio
+        request = {
+            "location": "34L0200708100",
+            "applicant": {
+                "name": "A", "title": "B", "salutation": "C",
+                "company": "D", "address": "E", "city_state_zip": "F",
+            },
+        }
+        async def scenario():
+            svc = service.Service(workers=1)
+            server = await svc.start(port=0)
+            port = server.sockets[0].getsockname()[1]
+            try:
+                gis["flood"].return_value = None
+                outage = await self.request(port, "POST", "/review", request)
+                gis["flood"].return_value = set()
+                gis["parcel"].return_value = None
+                missing = await self.request(port, "POST", "/review", request)
+            finally:
+                server.close()
+                svc.close()
+            return outage, missing
+        with mock_gis() as gis:
+            outage, missing = asyncio.run(scenario())
+        self.assertEqual(outage, (503, {"error": "flood hazard query failed for 34L0200708100"}))
+        self.assertEqual(missing[0], 404)
+
+
+class TestHotPaths(unittest.TestCase):
+    def test_compare(self):
+        """Cases over either threshold and the noise floor regress, and strict
+        comparisons fail on cases missing from the run or the baseline.
+        """
+        from benchmarks import hot_paths
+        baseline = {
+            "fast": {"seconds": 1.0, "peak_bytes": 100},
+            "lean": {"seconds": 1.0, "peak_bytes": 100000},
+            "tiny": {"seconds": 2e-6, "peak_bytes": 100},
+            "gone": {"seconds": 1.0, "peak_bytes": 100},
+        }
+        results = {
+            "fast": {"seconds": 1.5, "peak_bytes": 100},
+            "lean": {"seconds": 1.1, "peak_bytes": 110000},
+            "tiny": {"seconds": 4e-6, "peak_bytes": 200},
+            "new": {"seconds": 1.0, "peak_bytes": 100},
+        }
+        regressed = hot_paths.compare(results, baseline, 0.25, 0.25)
+        self.assertEqual(regressed, ["fast: time +50%, peak memory +0%"])
+        self.assertEqual(hot_paths.compare(results, baseline, 0.25, 0.05)[1:], ["lean: time +10%, peak memory +10%"])
+        self.assertEqual(hot_paths.compare(results, baseline, 0.25, 0.25, noise_floor=1e-6, memory_floor=0)[1:], ["tiny: time +100%, peak memory +100%"])
+        strict = hot_paths.compare(results, baseline, 0.25, 0.25, strict=True)
+        self.assertEqual(sorted(strict), ["fast: time +50%, peak memory +0%", "gone: not run", "new: no baseline"])
+
+    def test_require_baseline(self):
+        """A missing baseline only fails the gate when one is required."""
+        import io, tempfile
+        from contextlib import redirect_stdout
+        from benchmarks import hot_paths
+        with tempfile.TemporaryDirectory() as tmp, redirect_stdout(io.StringIO()):
+            missing = os.path.join(tmp, "baseline.json")
+            self.assertEqual(hot_paths.main(["--baseline", missing]), 0)
+            self.assertEqual(hot_paths.main(["--baseline", missing, "--require-baseline"]), 1)
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file